@@ -0,0 +1,78 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+# Small bounded caches shared by the calculators
+
+from collections import OrderedDict
+
+class LRUCache(object):
+    """A mapping that keeps only the maxsize most recently used entries.
+
+    >>> c = LRUCache(2)
+    >>> c['a'] = 1; c['b'] = 2
+    >>> c.get('a')
+    1
+    >>> c['c'] = 3
+    >>> 'b' in c, 'a' in c, len(c)
+    (False, True, 2)
+    >>> print c.get('b')
+    None
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            return default
+        self._data[key] = value  # move to the recent end
+        return value
+
+    def __setitem__(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        self._data.clear()
+
+def memoize(maxsize=128):
+    """Decorate a function of hashable arguments with an LRUCache.
+
+    >>> @memoize(10)
+    ... def square(x):
+    ...     print 'working'
+    ...     return x*x
+    >>> square(3)
+    working
+    9
+    >>> square(3)
+    9
+    """
+    def decorate(f):
+        cache = LRUCache(maxsize)
+        missing = object()
+        def wrapper(*args):
+            value = cache.get(args, missing)
+            if value is missing:
+                value = f(*args)
+                cache[args] = value
+            return value
+        wrapper.__name__ = f.__name__
+        wrapper.__doc__ = f.__doc__
+        wrapper.cache = cache
+        return wrapper
+    return decorate
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
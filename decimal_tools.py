@@ -3,15 +3,30 @@ from __future__ import with_statement, division
 from decimal import *
 import re
 import math
+from prime_tools import factorize, isprime, nextprime
+from factorial_tools import fact, perm, comb
 
-def pi():
-    """Compute Pi to the current precision.
+_constants = {}
 
-    >>> print pi()
-    3.141592653589793238462643383
+def _cached_constant(name, compute):
+    """Return the named constant rounded to the current precision.
 
+    Each constant is kept at the highest precision asked for so far (plus a
+    few guard digits) so that a request at a lower precision is just a
+    rounding of the cached value.  compute() is only called when we need more
+    digits than we have, and is run with the guard digits already added.
     """
-    getcontext().prec += 2  # extra digits for intermediate steps
+    prec = getcontext().prec
+    digits, value = _constants.get(name, (0, None))
+    if digits < prec:
+        with localcontext() as ctx:
+            ctx.prec = prec + 5
+            value = compute()
+        _constants[name] = (prec, value)
+    return +value           # unary plus applies the current precision
+
+def _pi_series():
+    """Sum a simple series for Pi; quickest at modest precision."""
     three = Decimal(3)      # substitute "three=3.0" for regular floats
     lasts, t, s, n, na, d, da = 0, three, 3, 1, 0, 0, 24
     while s != lasts:
@@ -20,69 +35,259 @@ def pi():
         d, da = d+da, da+32
         t = (t * n) / d
         s += t
-    getcontext().prec -= 2
-    return +s               # unary plus applies the new precision
+    return s
+
+def _chudnovsky_split(a, b):
+    """Return the integers P, Q, T for terms a..b-1 of the Chudnovsky series."""
+    if b-a == 1:
+        if a == 0:
+            p = q = 1
+        else:
+            p = (6*a-5)*(2*a-1)*(6*a-1)
+            q = a*a*a*10939058860032000  # 640320**3/24
+        t = p*(13591409+545140134*a)
+        if a & 1:
+            t = -t
+        return p, q, t
+    m = (a+b)//2
+    p1, q1, t1 = _chudnovsky_split(a, m)
+    p2, q2, t2 = _chudnovsky_split(m, b)
+    return p1*p2, q1*q2, q2*t1+p1*t2
+
+def _pi_chudnovsky():
+    """Compute Pi by binary splitting the Chudnovsky series.
+
+    Each term adds about 14 digits, and all the summing is done with integers
+    so the only Decimal work is one square root and one division at the end.
+    """
+    terms = getcontext().prec//14 + 2
+    p, q, t = _chudnovsky_split(0, terms)
+    return Decimal(426880) * Decimal(10005).sqrt() * q / t
+
+PI_SPLIT_PRECISION = 50  # above this many digits use the Chudnovsky engine
+
+def pi():
+    """Compute Pi to the current precision.
+
+    The value is cached, so repeated calls are cheap, and at high precision
+    we switch to the much faster Chudnovsky series.
+
+    >>> print pi()
+    3.141592653589793238462643383
+    >>> with localcontext() as ctx:
+    ...     ctx.prec = 60
+    ...     print pi()
+    3.14159265358979323846264338327950288419716939937510582097494
+    >>> with localcontext() as ctx:
+    ...     ctx.prec = 1000
+    ...     str(pi())[-10:]
+    '9216420199'
+
+    """
+    if getcontext().prec > PI_SPLIT_PRECISION:
+        return _cached_constant('pi', _pi_chudnovsky)
+    return _cached_constant('pi', _pi_series)
+
+def _precision_ladder(prec):
+    """Return the rising precisions for a Newton iteration started from a float.
+
+    Each step can (at least) double the good digits, so we work up from
+    about 30 digits to prec without wasting effort on the early steps.
+    """
+    ladder = [prec]
+    while ladder[-1] > 30:
+        ladder.append(ladder[-1]//2 + 2)
+    ladder.reverse()
+    return ladder
+
+def _acoth(n, one):
+    """Return acoth(n)*one, rounded down to an integer, for integer n>1."""
+    n2 = n*n
+    power = one//n
+    total = power
+    k = 1
+    while power:
+        power //= n2
+        k += 2
+        total += power//k
+    return total
+
+def _fixed_point(digits, f):
+    """Return f(10**digits)/10**digits as a Decimal."""
+    return Decimal(f(10**digits)).scaleb(-digits)
+
+def _ln2():
+    """ln(2) from a Machin-like formula, summed in fixed point integers."""
+    return _fixed_point(getcontext().prec+5,
+        lambda one: 18*_acoth(26, one) - 2*_acoth(4801, one) + 8*_acoth(8749, one))
+
+def _ln10():
+    """ln(10) = 3*ln(2) + ln(5/4) = 3*ln(2) + 2*acoth(9)."""
+    return _fixed_point(getcontext().prec+5,
+        lambda one: 3*(18*_acoth(26, one) - 2*_acoth(4801, one) + 8*_acoth(8749, one))
+                    + 2*_acoth(9, one))
+
+def ln2():
+    """Return ln(2) at the current precision (cached).
+
+    >>> print ln2()
+    0.6931471805599453094172321215
+    """
+    return _cached_constant('ln2', _ln2)
+
+def ln10():
+    """Return ln(10) at the current precision (cached).
+
+    >>> print ln10()
+    2.302585092994045684017991455
+    """
+    return _cached_constant('ln10', _ln10)
 
 def exp(x):
     """Return e raised to the power of x.  Result is a decimal.
 
+    We write x = n*ln(2) + r with |r| <= ln(2)/2, sum the series for r/2^k,
+    square the result k times, and finally scale by 2^n, so the work does
+    not grow with the size of x.
+
     >>> print exp(Decimal(1))
     2.718281828459045235360287471
     >>> print exp(Decimal(2))
     7.389056098930650227230427461
     >>> print exp(2.0)
     7.389056098930650227230427461
+    >>> print exp(Decimal(-1))
+    0.3678794411714423215955237702
+    >>> print exp(Decimal(1000))
+    1.970071114017046993888879352E+434
+    >>> print exp(0)
+    1
 
     """
     if not hasattr(x,'quantize'):
         x = Decimal(str(x))
+    if not x:
+        return Decimal(1)
     with localcontext() as ctx:
-        ctx.prec += 2
-        i, lasts, s, fact, num = 0, 0, 1, 1, 1
+        ctx.prec += 5
+        n = (x/ln2()).to_integral_value()
+        ctx.prec += len(str(abs(n)))    # digits lost in subtracting n*ln(2)
+        r = x - n*ln2()
+
+        k = int(ctx.prec**0.5)//2       # halvings, balanced against terms
+        ctx.prec += k//3 + 1            # guard digits for squaring k times
+        r /= 2**k
+        i, lasts, s, term = 0, 0, 1, Decimal(1)
         while s != lasts:
             lasts = s
             i += 1
-            fact *= i
-            num *= x
-            s += num / fact
+            term = term * r / i
+            s += term
+        for i in range(k):
+            s *= s
+        s *= Decimal(2)**int(n)
     return +s
 
 def ln(x):
     """Return a=ln(x), such that e^a=x.
 
+    We split x = m*10^e and solve exp(y) = m by Halley's iteration,
+    starting from the float answer and doubling the precision each step.
+
     >>> print ln(2)
     0.6931471805599453094172321215
     >>> print ln(Decimal("0.1"))
     -2.302585092994045684017991455
+    >>> print ln(Decimal("1E+100"))
+    230.2585092994045684017991455
+    >>> print ln(Decimal("1.000001"))
+    9.999995000003333330833335333E-7
+    >>> print ln(exp(Decimal(10)))
+    10.00000000000000000000000000
 
     """
+    if not hasattr(x,'quantize'):
+        x = Decimal(str(x))
+    if x<=0:
+        raise ValueError, "x must be positive"
+    if x==1:
+        return Decimal(0)
+
     with localcontext() as ctx:
-        ctx.prec += 2
-        base = exp(Decimal(1))
-        i_part = Decimal(0)
-        if x<=0:
-            raise ValueError, "x must be positive"
-
-        # we want x in the range 1<x<base
-        while x<1:    i_part -= 1; x *= base
-        if x==1: return 0
-        while x>base: i_part += 1; x /= base
-
-        n = Decimal("0.5")
-        x = x*x
-        f_part      = Decimal(0)
-        last_f_part = Decimal(1)
-        while last_f_part != f_part:
-            if x >= base:
-                last_f_part = f_part
-                f_part += n
-                x /= base
-            n /= 2
-            x = x*x
-        log = i_part+f_part
+        ctx.prec += 5
+        e = x.adjusted()
+        m = x.scaleb(-e)                 # so 1 <= m < 10
+        if m > 3:
+            e += 1
+            m = m.scaleb(-1)
+        if e == 0:                       # near 1 we need extra digits
+            ctx.prec += max(0, -(m-1).adjusted())
+
+        y = Decimal(repr(math.log(float(m))))
+        target = ctx.prec
+        for p in _precision_ladder(target):
+            ctx.prec = p
+            t = exp(y)
+            y += 2*(m-t)/(m+t)
+        ctx.prec = target
+        log = y + e*ln10()
     return +log
 
+def _sin_series(x):
+    """Sum the Taylor series for sin(x); best kept to |x| <= pi/4."""
+    i, lasts, s, num, sign, fact = 1, 0, x, x, 1, 1
+    xs = x*x
+    while s != lasts:
+        lasts = s
+        i += 2
+        fact *= i * (i-1)
+        num *= xs
+        sign = -sign
+        s += num / fact * sign
+    return s
+
+def sincos(x):
+    """Return the pair (sin(x), cos(x)) for x measured in radians.
+
+    We reduce x to r = x - q*pi/2 with |r| <= pi/4 using the cached pi, sum
+    one series for sin(r), get cos(r) from a square root, and then pick
+    the signs and order from the quadrant q.  If r is smaller than the last
+    digit of x, then x is taken to be an exact multiple of pi/2.
+
+    >>> s, c = sincos(Decimal('0.5'))
+    >>> print s, c
+    0.4794255386042030002732879352 0.8775825618903727161162815826
+    >>> s, c = sincos(pi())
+    >>> print s, c
+    0 -1
+    >>> print sincos(Decimal(1000))[1]
+    0.5623790762907029910782492266
+    >>> print sincos(Decimal(-3))[0]
+    -0.1411200080598672221007448028
+    >>> sincos(0.5)
+    (0.479425538604203, 0.8775825618903728)
+
+    """
+    if not hasattr(x,'remainder_near'):
+        return math.sin(x), math.cos(x)
 
+    prec = getcontext().prec
+    with localcontext() as ctx:
+        ctx.prec += 5
+        q = (x/(pi()/2)).to_integral_value()
+        r = x
+        if q:
+            ctx.prec += len(str(abs(q)))
+            r = x - q*(pi()/2)
+            if abs(r) < Decimal(5).scaleb(x.adjusted()-prec):
+                r = Decimal(0)
+        s = _sin_series(r)
+        c = (1-s*s).sqrt()
+        quadrant = int(q) % 4
+        if   quadrant == 1: s, c = c, -s
+        elif quadrant == 2: s, c = -s, -c
+        elif quadrant == 3: s, c = -c, s
+    return +s, +c
 
 def cos(x):
     """Return the cosine of x as measured in radians.
@@ -93,9 +298,14 @@ def cos(x):
     0.87758256189
     >>> print cos(0.5+0j)
     (0.87758256189+0j)
+    >>> print cos(pi()).normalize()
+    -1
 
     """
-    getcontext().prec += 2
+    if hasattr(x,'remainder_near'):
+        return sincos(x)[1]
+
+    # plain series, so that floats and complex numbers work too
     i, lasts, s, fact, num, sign = 0, 0, 1, 1, 1, 1
     while s != lasts:
         lasts = s
@@ -104,8 +314,7 @@ def cos(x):
         num *= x * x
         sign *= -1
         s += num / fact * sign
-    getcontext().prec -= 2
-    return +s
+    return s
 
 def sin(x):
     """Return the sine of x as measured in radians.
@@ -137,36 +346,105 @@ def sin(x):
     """
     if not hasattr(x,'remainder_near'):
         return math.sin(x)
+    return sincos(x)[0]
 
-    p = pi(); two_p = p*2; half_p = p/2
-    x = x.remainder_near(two_p) # first reduce so that -π<x<π
-    if x < 0:  # now make it positive since sin(-a)=-sin(a)
-        x_sign = -1
-        x = abs(x)
-    else:
-        x_sign = 1
+def tan(x):
+    """Return the tangent of x as measured in radians.
 
-    if x>half_p: # now reduce it to first quadrant
-        x = p-x
+    >>> print tan(Decimal(1))
+    1.557407724654902230506974807
+    >>> print tan(pi()/4)
+    1.000000000000000000000000000
+    >>> print tan(1.0)
+    1.55740772465
 
+    """
+    if not hasattr(x,'remainder_near'):
+        return math.tan(x)
     with localcontext() as ctx:
-        ctx.prec += 2
-        i, lasts, s, fact, num, sign = 1, 0, x, 1, x, 1
-        while s != lasts:
-            lasts = s
-            i += 2
-            fact *= i * (i-1)
-            num *= x * x
-            sign = -sign
-            s += num / fact * sign
+        ctx.prec += 5
+        s, c = sincos(x)
+        t = s/c
+    return +t
+
+def atan2(y, x):
+    """Return the angle in radians of the point (x, y), between -pi and pi.
+
+    We start from the float answer and refine it with
+    a <- a + (y cos a - x sin a)/(x cos a + y sin a)
+    which is Newton's method (and a bit better) on the sincos kernel,
+    doubling the precision at each step.
+
+    >>> print atan2(Decimal(1), Decimal(1))
+    0.7853981633974483096156608458
+    >>> print atan2(Decimal(1), Decimal(-1))
+    2.356194490192344928846982537
+    >>> print atan2(Decimal(-2), Decimal(0))
+    -1.570796326794896619231321692
+    >>> print atan2(Decimal(0), Decimal(-5))
+    3.141592653589793238462643383
+    >>> print atan2(Decimal(0), Decimal(0))
+    0
 
-        s*=x_sign
+    """
+    if not hasattr(y,'remainder_near') and not hasattr(x,'remainder_near'):
+        return math.atan2(y, x)
+    if not hasattr(y,'quantize'): y = Decimal(str(y))
+    if not hasattr(x,'quantize'): x = Decimal(str(x))
+
+    if not x:
+        if not y:
+            return Decimal(0)
+        return pi()/2 if y > 0 else -pi()/2
+    if not y:
+        return Decimal(0) if x > 0 else pi()
 
-    return +s
+    with localcontext() as ctx:
+        ctx.prec += 5
+        scale = -max(x.adjusted(), y.adjusted())  # keep the floats in range
+        a = Decimal(repr(math.atan2(float(y.scaleb(scale)), float(x.scaleb(scale)))))
+        target = ctx.prec
+        for p in _precision_ladder(target):
+            ctx.prec = p
+            s, c = sincos(a)
+            a += (y*c - x*s)/(x*c + y*s)
+    return +a
+
+def atan(x):
+    """Return the arc-tangent of x in radians.
+
+    >>> print atan(Decimal(1))
+    0.7853981633974483096156608458
+    >>> print atan(Decimal("-0.5"))
+    -0.4636476090008061162142562315
+    >>> print atan(Decimal("1E+30"))
+    1.570796326794896619231321692
+    >>> print atan(1.0)
+    0.785398163397
+
+    """
+    if not hasattr(x,'remainder_near'):
+        return math.atan(x)
+    return atan2(x, Decimal(1))
+
+def _arc(x, cosine):
+    """Return asin(x), or acos(x) if cosine is true, for -1<x<1.
+
+    sqrt(1-x*x) is worked out as sqrt((1-x)(1+x)) with a few extra digits
+    so that we keep accuracy near |x|=1.
+    """
+    with localcontext() as ctx:
+        ctx.prec += 5
+        side = ((1-x)*(1+x)).sqrt()
+        a = atan2(side, x) if cosine else atan2(x, side)
+    return +a
 
 def asin(x):
     """Return the arc-sine of x in radians, where -1<=x<=1
 
+    This is atan2(x, sqrt(1-x^2)), so it takes about the same time
+    for any x.
+
     >>> print asin(0)
     0
     >>> print asin(Decimal("0.5"))
@@ -177,42 +455,38 @@ def asin(x):
     True
     >>> print (asin(Decimal(1))==pi()/2)
     True
+    >>> print asin(Decimal("-0.999999"))
+    -1.569382113114672367468249896
 
     """
+    if not hasattr(x,'quantize'):
+        x = Decimal(str(x))
     if abs(x)>1: raise ValueError, "abs(x)>1"
 
-    if x==-1:   return -pi()/2
-    if x==-0.5: return -pi()/6
-    if x==0:    return Decimal(0)
-    if x==0.5:  return pi()/6
-    if x==1:    return pi()/2
+    if x==0:  return Decimal(0)
+    if x==1:  return pi()/2
+    if x==-1: return -pi()/2
+    return _arc(x, False)
 
-    if abs(x)>0.75:
-        flip = x.as_tuple()[0]
-        x = (1-x*x).sqrt() # work out acos instead and flip base to improve accuracy
-    else:
-        flip = -1
-
-    getcontext().prec += 2
-    i, lasts, s, fact, num = 0, 0, x, x, 1
-    xs = x**2
-    while s != lasts:
-        lasts = s
-        i += 2
-        fact = fact*xs*(i-1)/i
-        s = s + fact/(i+1)
+def acos(x):
+    """Return the arc-cosine of x in radians, where -1<=x<=1
 
-    if flip==1:
-        s = s-pi()/2
-    elif flip==0:
-        s = pi()/2-s
+    >>> print acos(Decimal("0.5"))
+    1.047197551196597746154214461
+    >>> print acos(Decimal(-1))
+    3.141592653589793238462643383
+    >>> print acos(Decimal("0.999999"))
+    0.001414213680224251763071795773
 
-    getcontext().prec -=2
-    return +s
+    """
+    if not hasattr(x,'quantize'):
+        x = Decimal(str(x))
+    if abs(x)>1: raise ValueError, "abs(x)>1"
 
-def acos(x):
-    """Return acos(x) == pi/2-asin(x)."""
-    return pi()/2-asin(x)
+    if x==1:  return Decimal(0)
+    if x==-1: return pi()
+    if x==0:  return pi()/2
+    return _arc(x, True)
 
 def pow(x,y):
     """Return x^y with full generality.
@@ -240,82 +514,6 @@ def gcd(n,m):
        m, n = n, r
     return n
 
-def fact(n):
-    """Return n factorial.
-
-    >>> fact(-1)
-    0
-    >>> fact(0)
-    1
-    >>> fact(1)
-    1
-    >>> fact(2)
-    2
-    >>> fact(3)
-    6
-    >>> fact(4)
-    24
-    >>> fact(5)
-    120
-    >>> fact(6)
-    720
-    >>> fact(6.1)
-    720
-    """
-    if n<0: return 0
-    a = 1
-    for b in range(2,int(n)+1):
-        a *= b
-    return a
-
-def perm(n,r):
-    """ Return the permutations of n things r at a time.
-
-    >>> perm(0,0)
-    1
-    >>> perm(0,1)
-    0
-    >>> perm(1,1)
-    1
-    >>> perm(8,5)
-    6720
-    """
-    if n<0: return 0
-    if r<0: return 0
-    if n<r: return 0
-    z = 1
-    for i in range(n-r+1,n+1):
-        z *= i
-    return z
-
-
-def comb(n,r):
-    """ Return the combinations of n things taken r at a time.
-
-    >>> comb(0,0)
-    1
-    >>> comb(0,1)
-    0
-    >>> comb(1,1)
-    1
-    >>> comb(8,5)
-    56
-    >>> comb(52,13)
-    635013559600L
-    """
-    if n<0: return 0
-    if r<0: return 0
-    if n<r: return 0
-    if n-r<r: r=n-r              #  Adjust r
-
-    z = 1
-    for i in range(n-r+1,n+1):
-        z*=i
-    for i in range(2,r+1):
-        z//=i
-    return z
-
-
 def sigfig(n,m):
     """Return n rounded to m significant figures.
 
@@ -339,98 +537,10 @@ def sigfig(n,m):
     except:
         return n
 
-def factorize(n):
-    """Return a list of factors of an integer (very slowly).
-
-    >>> print factorize(4294966189)
-    [53197, 80737]
-    >>> print factorize(4294966271)
-    [44617, 96263]
-    >>> print factorize(4294966272)
-    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 3, 23, 89, 683]
-    >>> print factorize(4294966339)
-    [13187, 325697]
-    >>> print factorize(4294966457)
-    [14891, 288427]
-    >>> print factorize(4294966464)
-    [2, 2, 2, 2, 2, 2, 3, 3, 3, 2485513]
-    >>> print factorize(4294966519)
-    [34583, 124193]
-    >>> print factorize(4294966573)
-    [23071, 186163]
-    >>> print factorize(4294966901)
-    [37747, 113783]
-    >>> print factorize(4294966969)
-    [44201, 97169]
-    >>> print factorize(4294966998)
-    [2, 3, 7, 3917, 26107]
-    >>> print factorize(4294967071)
-    [65521, 65551]
-    >>> print factorize(4294967291)
-    [4294967291]
-    >>> print factorize(4294967293)
-    [9241, 464773]
-    >>> print factorize(9)
-    [3, 3]
-    >>> print factorize(-1)
-    -1
-    >>> print factorize(4294966194)
-    [2, 3, 3, 3, 3, 3, 3, 3, 53, 97, 191]
-    >>> print factorize(4294966201)
-    [12197, 352133]
-    >>> print factorize(4294966400)
-    [2, 2, 2, 2, 2, 2, 2, 5, 5, 1342177]
-    >>> print factorize(4294966561)
-    [36067, 119083]
-    >>> print factorize(4294966631)
-    [13729, 312839]
-    >>> print factorize(4294966691)
-    [39241, 109451]
-    >>> print factorize(4294966759)
-    [21649, 198391]
-    >>> print factorize(4294966789)
-    [50411, 85199]
-    >>> print factorize(4294966896)
-    [2, 2, 2, 2, 3, 3, 3, 11, 607, 1489]
-    >>> print factorize(4294967099)
-    [44483, 96553]
-    >>> print factorize(4294967101)
-    [23603, 181967]
-    >>> print factorize(4294967213)
-    [57139, 75167]
-    >>> print factorize(4294967292)
-    [2, 2, 3, 3, 7, 11, 31, 151, 331]
-    """
-    if n <=1:
-        return n
-
-    n = int(n)
-    factors = []
-    while n%2==0: factors.append(2); n//=2
-    while n%3==0: factors.append(3); n//=3
-    while n%5==0: factors.append(5); n//=5
-    while n%7==0: factors.append(7); n//=7
-    primes = [11, 13, 17, 19, 23, 29, 31, 37]
-    i = 0
-    keep_going = True;
-    while keep_going:
-        for j in range(8):
-            p = i + primes[j]
-            q = n//p
-            if p>q:
-                keep_going=False
-                break
-            while (n==q*p):
-                factors.append(p)
-                n=q
-                q=n//p
-        i+=30
-
-    if n>1:
-        factors.append(n)
-    return factors
-
-
+# a Decimal constructor string, without Infinity or NaN; the maynard lexer
+# and importer build their patterns from this one
+NUMBER = r'[-+]?(?:\d+\.\d*|\.?\d+)(?:[eE][-+]?\d+)?'
+_number_pattern = re.compile(r'\A%s\Z' % NUMBER)
 
 def looks_like_a_number(s):
     """Match a decimal constructor string.
@@ -462,10 +572,7 @@ def looks_like_a_number(s):
     False
 
     """
-    if re.match(r'\A[-+]?(\d+\.\d*|\.?\d+)([eE][-+]?\d+)?\Z',s):
-        return True
-    else:
-        return False
+    return _number_pattern.match(s) is not None
 
 
 if __name__ == "__main__":
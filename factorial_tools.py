@@ -0,0 +1,146 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+# Factorials, permutations, and combinations of (big) integers
+#
+# Everything is built on balanced product trees, so that the big
+# multiplications are done between numbers of similar size, and on the
+# prime factorization of n! (Legendre) and of C(n, r) (Kummer).
+
+from __future__ import division
+from prime_tools import primes_below
+from cache_tools import LRUCache
+
+def _product(numbers, lo, hi):
+    """Return the product of numbers[lo:hi], multiplied as a balanced tree."""
+    if hi - lo <= 8:
+        z = 1
+        for i in range(lo, hi):
+            z *= numbers[i]
+        return z
+    mid = (lo+hi)//2
+    return _product(numbers, lo, mid) * _product(numbers, mid, hi)
+
+def _range_product(lo, hi):
+    """Return lo*(lo+1)*...*hi, or 1 if the range is empty.
+
+    >>> _range_product(4, 8)
+    6720
+    >>> _range_product(5, 4)
+    1
+    """
+    if hi - lo < 16:
+        z = 1
+        for i in range(lo, hi+1):
+            z *= i
+        return z
+    mid = (lo+hi)//2
+    return _range_product(lo, mid) * _range_product(mid+1, hi)
+
+def _legendre(n, p):
+    """Return the exponent of the prime p in n!"""
+    e = 0
+    while n:
+        n //= p
+        e += n
+    return e
+
+def _prime_power_product(n, exponent):
+    """Return the product of p**exponent(p) over the primes p <= n."""
+    powers = []
+    for p in primes_below(n+1):
+        e = exponent(p)
+        if e:
+            powers.append(p**e)
+    return _product(powers, 0, len(powers))
+
+SMALL_FACTORIAL = 300   # below this a plain product tree is quicker
+SMALL_CHOICE = 50       # and below this r we use perm(n,r)/r!
+_recent_factorials = LRUCache(32)
+
+def fact(n):
+    """Return n factorial.
+
+    >>> fact(-1)
+    0
+    >>> fact(0)
+    1
+    >>> fact(1)
+    1
+    >>> fact(2)
+    2
+    >>> fact(3)
+    6
+    >>> fact(4)
+    24
+    >>> fact(5)
+    120
+    >>> fact(6)
+    720
+    >>> fact(6.1)
+    720
+    >>> fact(1000) == _range_product(1, 1000)
+    True
+    """
+    if n<0: return 0
+    n = int(n)
+    z = _recent_factorials.get(n)
+    if z is None:
+        if n < SMALL_FACTORIAL:
+            z = _range_product(2, n)
+        else:
+            z = _prime_power_product(n, lambda p: _legendre(n, p))
+        _recent_factorials[n] = z
+    return z
+
+def perm(n,r):
+    """ Return the permutations of n things r at a time.
+
+    >>> perm(0,0)
+    1
+    >>> perm(0,1)
+    0
+    >>> perm(1,1)
+    1
+    >>> perm(8,5)
+    6720
+    """
+    if n<0: return 0
+    if r<0: return 0
+    if n<r: return 0
+    n, r = int(n), int(r)
+    return _range_product(n-r+1, n)
+
+def comb(n,r):
+    """ Return the combinations of n things taken r at a time.
+
+    For large r we count the power of each prime p in n!/(r!(n-r)!)
+    directly, which saves building the huge numerator.
+
+    >>> comb(0,0)
+    1
+    >>> comb(0,1)
+    0
+    >>> comb(1,1)
+    1
+    >>> comb(8,5)
+    56
+    >>> print comb(52,13)
+    635013559600
+    >>> comb(1000,400) == fact(1000)//fact(400)//fact(600)
+    True
+    """
+    if n<0: return 0
+    if r<0: return 0
+    if n<r: return 0
+    n, r = int(n), int(r)
+    if n-r<r: r=n-r              #  Adjust r
+
+    if r < SMALL_CHOICE:
+        return _range_product(n-r+1, n)//_range_product(2, r)
+    return _prime_power_product(n,
+        lambda p: _legendre(n, p) - _legendre(r, p) - _legendre(n-r, p))
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,241 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+# Reading the maynard.cfg file
+#
+# The command bodies are compiled once as the file is read, and the
+# result is kept keyed by the modification time of the file, so that
+# running maynard again in the same Vim session costs nothing at all
+# unless the file has been edited.  The parsed file is also saved next
+# to the config as maynard.cfg.cache, so that a fresh Vim can load it
+# with a single read instead of parsing the file again.
+
+import os
+import re
+import sys
+import marshal
+import hashlib
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from decimal import Decimal, localcontext
+from maynard_units import UnitIndex
+
+DEFAULT_CONFIG = "/Users/toby/python/maynard.cfg"
+
+unit_line_pattern  = re.compile(r'^u:\s*(\S+)\s+(\S+)\s+(\S+)(\s+\S+)?')
+cmd_line_pattern   = re.compile(r'^c:\s*(\S+)\s+(\S.*)')
+stack_line_pattern = re.compile(r'^t:\s*(\S+)')
+opt_line_pattern   = re.compile(r'^o:\s*(\S+)\s+(\S.*)')
+dim_line_pattern   = re.compile(r'^d:\s*(\S+)\s+(\S+)(\s+\S+)?')
+macro_line_pattern = re.compile(r'^m:\s*(\S+)\s+(\S.*)')
+
+class Config(object):
+    """The parsed contents of a config file.
+
+    lines    -- the raw lines, so that the file can be written back
+    commands -- command name -> compiled code object (synonyms share one)
+    sources  -- command name -> the source text of the command
+    macros   -- macro name -> its text, a line of maynard input
+    units    -- unit name (lower case) -> (dimension, name, factor, offset)
+                with factor and offset (or None) as Decimals
+    dimensions -- dimension name -> (expression, scale) from d: lines
+    unit_index -- a maynard_units.UnitIndex built from the last two
+    options  -- o: settings as found in the file
+    stack    -- the saved stack as a list of Decimals
+    errors   -- messages about commands that would not compile
+    """
+    def __init__(self):
+        self.lines = []
+        self.commands = {}
+        self.sources = {}
+        self.macros = {}
+        self.units = {}
+        self.dimensions = {}
+        self.unit_index = UnitIndex({}, {})
+        self.options = {}
+        self.stack = []
+        self.errors = []
+
+    def __getstate__(self):
+        """Pickle the code objects with marshal, keeping synonyms as names."""
+        state = self.__dict__.copy()
+        canonical, aliases, first_name = {}, {}, {}
+        for key in sorted(self.commands):
+            code = self.commands[key]
+            if id(code) in first_name:
+                aliases[key] = first_name[id(code)]
+            else:
+                first_name[id(code)] = key
+                canonical[key] = code
+        state['commands'] = marshal.dumps(canonical)
+        state['aliases'] = aliases
+        return state
+
+    def __setstate__(self, state):
+        aliases = state.pop('aliases')
+        state['commands'] = marshal.loads(state['commands'])
+        for key, target in aliases.items():
+            state['commands'][key] = state['commands'][target]
+        self.__dict__.update(state)
+
+UNIT_PRECISION = 34
+_literal_pattern = re.compile(r'(\d+(?:\.\d*)?|\.\d+)')
+
+def unit_factor(expression):
+    """Evaluate a unit factor like 0.0254*12 exactly, in Decimal arithmetic.
+
+    >>> unit_factor('(0.0254*12)**2')
+    Decimal('0.09290304')
+    >>> unit_factor('5/9')
+    Decimal('0.5555555555555555555555555555555556')
+    """
+    with localcontext() as ctx:
+        ctx.prec = UNIT_PRECISION
+        return +eval(_literal_pattern.sub(r"Decimal('\1')", expression),
+                     {'__builtins__': {}, 'Decimal': Decimal})
+
+def parse_config(lines, filename='maynard.cfg'):
+    """Parse an iterable of config lines into a Config.
+
+    >>> cfg = parse_config(['c: add a,b=get(2);put(a+b)', 'c: + add',
+    ...                     'c: bad put(', 'u: LENGTH IN 0.0254',
+    ...                     'm: Double 2 *', 'o: precision 20', 't: 42'])
+    >>> cfg.commands['+'] is cfg.commands['add']
+    True
+    >>> cfg.sources['+']
+    'a,b=get(2);put(a+b)'
+    >>> 'bad' in cfg.commands, len(cfg.errors)
+    (False, 1)
+    >>> cfg.units['in']
+    ('LENGTH', 'IN', Decimal('0.0254'), None)
+    >>> cfg.macros
+    {'double': '2 *'}
+    >>> cfg.options, cfg.stack
+    ({'precision': 20}, [Decimal('42')])
+    """
+    cfg = Config()
+    for line in lines:
+        cfg.lines.append(line)
+
+        m = unit_line_pattern.match(line)
+        if m != None:
+            dimension, name, factor, offset = m.groups()
+            try:
+                cfg.units[name.lower()] = (dimension, name, unit_factor(factor),
+                                           Decimal(offset) if offset else None)
+            except Exception:
+                cfg.errors.append('Unit %s has a bad factor: %s' % (name, factor))
+            continue
+
+        m = dim_line_pattern.match(line)
+        if m != None:
+            name, expression, scale = m.groups()
+            try:
+                cfg.dimensions[name] = (expression, unit_factor(scale) if scale else Decimal(1))
+            except Exception:
+                cfg.errors.append('Dimension %s has a bad scale: %s' % (name, scale))
+            continue
+
+        m = cmd_line_pattern.match(line)
+        if m != None:
+            key = m.group(1).lower()
+            value = m.group(2)
+            # allow synonyms...
+            if value in cfg.commands:
+                cfg.commands[key] = cfg.commands[value]
+                cfg.sources[key] = cfg.sources[value]
+                continue
+            try:
+                cfg.commands[key] = compile(value, '%s:%s' % (filename, key), 'exec')
+                cfg.sources[key] = value
+            except SyntaxError:
+                cfg.errors.append('Command %s does not compile: %s' % (key, value))
+            continue
+
+        m = macro_line_pattern.match(line)
+        if m != None:
+            cfg.macros[m.group(1).lower()] = m.group(2).strip()
+            continue
+
+        m = stack_line_pattern.match(line)
+        if m != None:
+            cfg.stack.append(Decimal(m.group(1)))
+            continue
+
+        m = opt_line_pattern.match(line)
+        if m != None:
+            key = m.group(1).lower()
+            try:
+                cfg.options[key] = int(m.group(2))
+            except:
+                cfg.options[key] = m.group(2)
+            continue
+
+    cfg.unit_index = UnitIndex(cfg.units, cfg.dimensions)
+    return cfg
+
+CACHE_FORMAT = 3
+_loaded = {}
+
+def _read_cache(cache_file):
+    """Return the pickled (header, Config) from cache_file, or None."""
+    try:
+        with open(cache_file, 'rb') as f:
+            header = pickle.load(f)
+            if header.get('format') != (CACHE_FORMAT, sys.version):
+                return None
+            return header, pickle.load(f)
+    except Exception:
+        return None
+
+def _write_cache(cache_file, header, cfg):
+    """Save the Config, writing a new file and renaming it into place."""
+    temp_file = cache_file + '.new'
+    try:
+        with open(temp_file, 'wb') as f:
+            pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(cfg, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp_file, cache_file)
+    except (IOError, OSError):
+        pass    # a cache we cannot write is not worth complaining about
+
+def load_config(config_file):
+    """Return the Config for config_file, reading it only if it has changed.
+
+    We check first in memory (by mtime), then in the cache file next to
+    the config (by mtime and size, and failing that by a hash of the
+    contents), and only parse the file if neither matches.
+
+    The result is shared between callers, so treat it as read only.
+    """
+    st = os.stat(config_file)
+    stamp = (st.st_mtime, st.st_size)
+    cached = _loaded.get(config_file)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    cache_file = config_file + '.cache'
+    cached = _read_cache(cache_file)
+    if cached is not None and cached[0]['stamp'] == stamp:
+        cfg = cached[1]
+    else:
+        with open(config_file, 'rb') as f:
+            text = f.read()
+        digest = hashlib.sha1(text).hexdigest()
+        if cached is not None and cached[0]['digest'] == digest:
+            cfg = cached[1]         # touched but not changed
+        else:
+            if not isinstance(text, str):
+                text = text.decode('utf-8')
+            cfg = parse_config(text.splitlines(True), os.path.basename(config_file))
+        header = {'format': (CACHE_FORMAT, sys.version), 'stamp': stamp, 'digest': digest}
+        _write_cache(cache_file, header, cfg)
+
+    _loaded[config_file] = (stamp, cfg)
+    return cfg
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
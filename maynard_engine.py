@@ -0,0 +1,548 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+# The maynard RPN engine, without Vim
+#
+# maynard.py wraps this in a Vim prompt; run this file directly to feed
+# RPN programs through it from files or standard input:
+#
+#     echo '2 3 + 4 *' | python maynard_engine.py -c maynard.cfg
+#
+# Each line of input is run as a program on the same stack, and after
+# each line the top of the stack is written to standard output, unless
+# the line used the copy char (=, ==, ...) which writes those items
+# instead.  Messages go to standard error.
+
+import re
+import sys
+import decimal
+from decimal import Decimal, getcontext
+import date_tools
+import decimal_tools
+import stats_tools
+from decimal_tools import sigfig, looks_like_a_number, NUMBER
+from cache_tools import memoize
+from maynard_config import Config, parse_config, load_config, DEFAULT_CONFIG
+from maynard_stack import Stack, History
+from maynard_macro import fuse
+
+SYMBOLS = ["∞","¶","•","°","∑","π","∏","µ","√","∫","∂","∆","¬"]
+
+@memoize(8)
+def _scanner(copy_char, whole_words=True):
+    """Compile the master pattern for the lexer.
+
+    With whole_words, the first alternatives pick out a complete word
+    that is a number (like -2E-3) or might be a compound unit (km/hour);
+    the rest split up mixed input like 5sqrt or 2**3.
+    """
+    whole = r"""
+        (?P<space>\s+)
+      | (?<!\S)(?P<number>%s)(?!\S)
+      | (?<!\S)(?P<compound>[^\s*/]+(?:[*/][^\s*/]+)+)(?!\S)
+      | """ % NUMBER
+    return re.compile((whole if whole_words else r"(?P<space>\s+) | ") + r"""
+        (?P<symbol>%s)
+      | (?P<word>[a-z<>]+)
+      | (?P<digits>[0-9.]+)
+      | (?P<operator>[+*/]{1,2})
+      | (?P<copy>(?:%s)+)
+      | (?P<other>.)
+    """ % ('|'.join(re.escape(s) for s in SYMBOLS), re.escape(copy_char)),
+    re.VERBOSE | re.DOTALL)
+
+def _scan(s, scanner, copy_char, is_unit, is_name, tokens):
+    word_end = None
+    for m in scanner.finditer(s):
+        kind, text = m.lastgroup, m.group()
+        if kind == 'space':
+            continue
+        if kind == 'compound':
+            if is_unit is None or not is_unit(text):
+                _scan(text, _scanner(copy_char, False), copy_char, is_unit, is_name, tokens)
+                continue
+            kind = 'word'
+        elif kind == 'digits':
+            if (word_end == m.start() and is_name is not None
+                    and is_name(tokens[-1][1] + text)):
+                tokens[-1] = ('word', tokens[-1][1] + text)
+                continue
+            kind = 'number' if looks_like_a_number(text) else 'word'
+        elif kind == 'other':
+            kind = 'operator'
+        tokens.append((kind, text))
+        word_end = m.end() if m.lastgroup == 'word' else None
+
+@memoize(256)
+def lex(s, copy_char='=', is_unit=None, is_name=None):
+    """Split user input into a tuple of typed tokens, in one pass.
+
+    The types are number, word, symbol, copy, and operator.  Results are
+    kept for the most recent input lines, so repeating a line is free.
+    If is_name is given, a word run straight into digits (like atan2) is
+    kept whole when is_name is true for it.
+
+    >>> lex('2 3+ 5sqrt π ==')
+    (('number', '2'), ('number', '3'), ('operator', '+'), ('number', '5'), ('word', 'sqrt'), ('symbol', '\xcf\x80'), ('copy', '=='))
+    >>> lex('1 1atan2', is_name=lambda w: w == 'atan2'), lex('x2')
+    ((('number', '1'), ('number', '1'), ('word', 'atan2')), (('word', 'x'), ('number', '2')))
+    """
+    tokens = []
+    _scan(s, _scanner(copy_char), copy_char, is_unit, is_name, tokens)
+    return tuple(tokens)
+
+def tokens_from(s, copy_char='=', is_unit=None):
+    """Get commands, numbers, and operators from user input.
+
+    This elaborate scheme turns user input into a stream of tokens and 
+    allows the user to omit as many spaces as possible.  
+    So "2 3+" produces "['2', '3', '+']"
+    and "5sqrt" produces "['5', 'sqrt']"
+    etc.
+
+    A word that is a number as a whole (like -2E-3) is kept as one;
+    otherwise we split into runs of letters, runs of digits, doubletons
+    (eg ** ++ //), runs of the copy char, and single other characters.
+    If is_unit is given, then words like km/hour for which it is true
+    are kept whole as compound units.
+
+    >>> tokens_from('2 3+')
+    ['2', '3', '+']
+    >>> tokens_from('5sqrt 2**3 -2E-3 ==')
+    ['5', 'sqrt', '2', '**', '3', '-2E-3', '==']
+    >>> tokens_from('60 km/hour', is_unit=lambda w: w == 'km/hour')
+    ['60', 'km/hour']
+    >>> tokens_from('4 3-2 >deg x*** 1.2.3')
+    ['4', '3', '-', '2', '>deg', 'x', '**', '*', '1.2.3']
+    """
+    return [text for kind, text in lex(s, copy_char, is_unit)]
+
+# todo:
+def looks_like_an_expr(s): return False
+
+DEFAULT_OPTIONS = { 'enter_key'  : "dup",              \
+                    'precision'  : getcontext().prec,  \
+                    'fix_digits' : 9,                  \
+                    'copy_char'  : '=',                \
+                    'window'     : 20,                 \
+                    'paste_at'   : 'above',            \
+                    'paste_align': 'none',             \
+                    'import_columns' : 0,              \
+                    'import_sep'     : 'space',        \
+                    'import_pattern' : 'none',         \
+                    'import_lazy'    : 0,              \
+                    'history'        : 100,            \
+                  }
+
+HELP = """Brother Maynard - a simple RPN calculator for VIM in Python
+                  Use it a bit like an HP calculator, ie 2 2 + will produce 4
+                  "quit" to finish; "=" copies the "top" of the stack to your current buffer.
+
+                  "... and the number of the counting shall be three."
+                  """
+
+# words the engine acts on itself, which cannot be macro names
+KEYWORDS = frozenset('fix all prec undo redo rec end ~ ? µ'.split())
+
+def command_namespace():
+    """Return the globals that the config commands are run in.
+
+    This is what "from decimal_tools import *" and so on would give, so
+    that our methods override those in decimal.
+    """
+    namespace = {'decimal': decimal, 're': re, 'sys': sys}
+    for module in (decimal_tools, date_tools, stats_tools):
+        for name, value in vars(module).items():
+            if not name.startswith('_'):
+                namespace[name] = value
+    return namespace
+
+def align(lines, how='none'):
+    """Line up a block of formatted numbers for pasting.
+
+    how is none (leave them as formatted), left, right, or point (line
+    up the decimal points).
+
+    >>> align(['  3.25', '  -10', ' 0.5'], 'left')
+    ['3.25', '-10', '0.5']
+    >>> align(['3.25', '-10', '0.5'], 'right')
+    ['3.25', ' -10', ' 0.5']
+    >>> align(['3.25', '-10', '0.125'], 'point')
+    ['  3.25 ', '-10    ', '  0.125']
+    """
+    if how == 'none':
+        return lines
+    lines = [x.strip() for x in lines]
+    if how == 'right':
+        width = max(len(x) for x in lines)
+        return [x.rjust(width) for x in lines]
+    if how == 'point':
+        parts = [x.partition('.') for x in lines]
+        left = max(len(a) for a, dot, b in parts)
+        right = max(len(dot + b) for a, dot, b in parts)
+        return [a.rjust(left) + (dot + b).ljust(right) for a, dot, b in parts]
+    return lines
+
+class Engine(object):
+    """A maynard calculator: a stack, the config commands, and the options.
+
+    copy is called with a list of formatted strings whenever the copy
+    char is used; the Vim front end pastes them into the buffer.
+
+    Each line run is one step for undo and redo, which keep only what the
+    step took off the stack and put on it (and any options it set), and
+    the observers are called with that change, the options, and the
+    macros recorded (not those from the config) after each step.
+
+    Macros come from m: lines in the config, or from recording: "rec"
+    starts, and "end name" stops and defines the macro name as whatever
+    was entered in between ("rec end name" removes it).  A macro cannot
+    take the name of a command, a unit, or a word like undo.
+
+    >>> cfg = parse_config(['c: add a,b=get(2);put(a+b)', 'c: + add',
+    ...                     'c: dup a=get(); put(a,a);',
+    ...                     'u: LENGTH M 1', 'u: LENGTH IN 0.0254'])
+    >>> calc = Engine(cfg, copy=lambda lines: sys.stdout.write(' '.join(lines) + '\\n'))
+    >>> calc.options['fix_digits'] = 0
+    >>> calc.run('2 3+ dup+ =')
+    10
+    ''
+    >>> calc.run('100 in')
+    'Pending unit: in\\n'
+    >>> calc.run('m')
+    '100.0 in ~ 2.540 m\\n'
+    >>> calc.run('frobnicate')
+    'Ignored >>frobnicate<<\\n'
+    >>> calc.run('1 2 3'); calc.run('+ +'); calc.run('undo'); calc.stack[-3:]
+    ''
+    ''
+    ''
+    [Decimal('1'), Decimal('2'), Decimal('3')]
+    >>> calc.run('undo'); calc.run('redo redo'); calc.stack[-1]
+    ''
+    ''
+    Decimal('6')
+    >>> calc.run('redo')
+    'Nothing to redo\\n'
+    >>> calc.run('rec dup + end'); calc.run('double'); calc.run('5 double double')
+    'Recording: finish with end <name>\\n'
+    'Macro double: dup +\\n'
+    ''
+    >>> calc.stack[-1]
+    Decimal('20')
+    >>> calc.run('rec dup end undo'), calc.run('rec 2 * end in')
+    ('Cannot call a macro undo\\n', 'Cannot call a macro in\\n')
+    >>> calc.run('rec end double'), calc.run('double')
+    ('Macro double removed\\n', 'Ignored >>double<<\\n')
+
+    None of the commands in the maynard.cfg that comes with maynard hides
+    one of its units:
+
+    >>> import os
+    >>> here = os.path.dirname(os.path.abspath(__file__))
+    >>> shipped = Engine(parse_config(open(os.path.join(here, 'maynard.cfg'))))
+    >>> sorted(set(shipped.cfg.commands) & set(shipped.cfg.units))
+    []
+    >>> shipped.run('90 min hour')
+    '90.00 min ~ 1.500 hour\\n'
+    >>> shipped.run('1 1 atan2'); shipped.stack[-1] == decimal_tools.pi()/4
+    ''
+    True
+
+    and a fused macro leaves lx what the commands one by one would:
+
+    >>> shipped.run('3 4 hyp lx'); shipped.stack[-2:]
+    ''
+    [Decimal('5'), Decimal('25')]
+    """
+    def __init__(self, cfg=None, copy=None):
+        if cfg is None:
+            cfg = Config()
+        self.cfg = cfg
+        self._is_command = frozenset(cfg.commands).__contains__     # hashable, for lex
+        self.copy = copy or (lambda lines: None)
+        self.stack = Stack()
+        self.memory = {}
+        self.options = dict(DEFAULT_OPTIONS)
+        self.options.update(cfg.options)
+        self.pending_unit = ''
+        self.history = History(self.options['history'])
+        self.observers = []
+        self._settled_options = dict(self.options)
+        self.macros = {}            # recorded ones, which override the config
+        self._settled_macros = {}
+        self._fused = {}
+        self.recording = None
+
+        self.namespace = command_namespace()
+        self.namespace.update(stack=self.stack,
+                              last_operands=self.stack.last_operands,
+                              get=self.stack.get,
+                              take=self.stack.take,
+                              put=self.stack.put,
+                              memory=self.memory,
+                              o=self.options)
+
+    def settle(self, record=True):
+        """Finish a step: keep its change for undo (if record is true)
+        and pass it on to the observers."""
+        stack, o = self.stack, self.options
+        change = stack.changes()
+        stack.mark()
+        before = self._settled_options
+        options = [(key, before.get(key), o[key]) for key in o
+                   if before.get(key, self) != o[key]]
+        self._settled_options = dict(o)
+        macros_changed = self.macros != self._settled_macros
+        self._settled_macros = dict(self.macros)
+        if not (change[0] or change[1] or options or macros_changed):
+            return
+        if record:
+            self.history.limit = int(o['history'])
+            self.history.record(change + (options,))
+        for observer in self.observers:
+            observer(change, o, self.macros)
+
+    def _replay(self, step, backwards):
+        """Do a step from the history again, or undo it."""
+        dropped, pushed, options = step
+        if backwards:
+            dropped, pushed = pushed, dropped
+        for x in dropped:
+            self.stack.pop()
+        self.stack.extend(pushed)
+        for key, old, new in options:
+            value = old if backwards else new
+            if value is None:
+                self.options.pop(key, None)
+            else:
+                self.options[key] = value
+            if key == 'precision':
+                getcontext().prec = self.options[key]
+
+    def format(self, n):
+        o = self.options
+        if o['fix_digits'] > 0:
+            n = n.quantize(Decimal((0,(1,),int(-o['fix_digits']))))
+            return str(n).rjust(o['precision'])
+        return str(n)
+
+    def run(self, user_input):
+        """Run a line of input and return the message for the user."""
+        o = self.options
+        msg = ''
+
+        if user_input == "": user_input = o['enter_key']
+
+        for kind, token in lex(user_input, o['copy_char'], self.cfg.unit_index.__contains__,
+                               self._is_command):
+            if self.recording is not None:
+                if self.recording and self.recording[-1] == "end":
+                    msg = self.define(token, ' '.join(self.recording[:-1]))
+                    self.recording = None
+                    continue
+                self.recording.append(token)
+                if token == "end":
+                    continue
+            elif token == "rec":
+                self.recording = []
+                msg = "Recording: finish with end <name>\n"
+                continue
+            msg = self._do(kind, token) or msg
+
+        self.settle()
+        return msg
+
+    def _do(self, kind, token):
+        """Act on one token, and return a message or None."""
+        o = self.options
+        stack = self.stack
+        put = stack.put
+        units = self.cfg.unit_index
+        code_for = self.cfg.commands
+        msg = None
+
+        if kind == 'copy':
+            self.copy(align([self.format(x) for x in stack[-len(token):]],
+                            o['paste_align']))
+        elif kind == 'number': put(Decimal(token))
+        elif looks_like_an_expr(token):  put(Decimal(str(eval(token))))
+        elif token in code_for:  
+            try:
+                exec(code_for[token], self.namespace)
+            except:
+                reason = str(sys.exc_info()[1]).replace("'",'"')
+                msg = self.cfg.sources[token] + ' caused an exception\n-> '+reason+'\n' 
+        elif token == "fix": 
+            o['fix_digits']=stack.pop()
+            if o['fix_digits']>=o['precision']:
+                o['precision'] = int(o['fix_digits']+2)
+                getcontext().prec = o['precision']
+        elif token == "all": o['fix_digits']=0
+        elif token == "prec": 
+            o['precision'] = int(stack.pop());
+            getcontext().prec=o['precision']
+            if o['precision']<o['fix_digits']:
+                o['fix_digits'] = o['precision'] - 2
+        elif token in ("undo", "redo"):
+            self.settle()
+            step = self.history.undo() if token == "undo" else self.history.redo()
+            if step is None:
+                msg = "Nothing to " + token + "\n"
+            else:
+                self._replay(step, token == "undo")
+                self.settle(record=False)
+        
+        elif token in units:
+            pending_unit = self.pending_unit
+            self.pending_unit = ''
+            if pending_unit == '':
+                self.pending_unit = token
+                msg = "Pending unit: " + token + "\n"
+            elif units.lookup(pending_unit).signature != units.lookup(token).signature:
+                msg = "Cannot convert " + pending_unit + " to " + token + "\n"
+            else:
+                a = stack.pop()
+                msg = str(sigfig(a,4))+' '+pending_unit+' ~ '
+                a = units.convert(a, pending_unit, token)
+                put(a)
+                msg += str(sigfig(a,4))+' '+token+'\n'
+        elif token in self.macros or token in self.cfg.macros:
+            msg = self.run_macro(token)
+        elif token == "~":
+            msg = ':'.join(sorted(list(set(code_for) | set(self.macros) | set(self.cfg.macros)))) + '\n'
+        elif token == "µ":
+            msg = '\n'.join(r'%d -> %s' % (k,v) for (k,v) in self.memory.items()) + '\n'
+        elif token == "?": 
+            msg = HELP
+        else: 
+            msg = "Ignored >>" + token + "<<\n"
+        return msg
+
+    def define(self, name, text):
+        """Make text (a line of input) the macro called name, or remove
+        the macro if text is empty, and return a message."""
+        name = name.lower()
+        if not text:
+            if self.macros.pop(name, None) is None:
+                return "Nothing recorded for " + name + "\n"
+            self._fused.clear()
+            return "Macro " + name + " removed\n"
+        if (name in self.cfg.commands or name in KEYWORDS or name in self.cfg.unit_index
+                or not re.match(r'[^\W\d]\w*\Z', name, re.U)):
+            return "Cannot call a macro " + name + "\n"
+        self.macros[name] = text
+        self._fused.clear()
+        return "Macro " + name + ": " + text + "\n"
+
+    def _expand(self, name, calling=()):
+        """Return the tokens of a macro, with any macros it uses written out."""
+        if name in calling:
+            raise ValueError("macro %s calls itself" % name)
+        tokens = []
+        text = self.macros.get(name, self.cfg.macros.get(name))
+        for kind, token in lex(text, self.options['copy_char'],
+                               self.cfg.unit_index.__contains__, self._is_command):
+            if (token in self.macros or token in self.cfg.macros) and token not in self.cfg.commands:
+                tokens.extend(self._expand(token, calling + (name,)))
+            else:
+                tokens.append((kind, token))
+        return tokens
+
+    def run_macro(self, name):
+        """Run a macro, fusing it into functions the first time, and return any message."""
+        key = (name, self.options['copy_char'])
+        msg = None
+        try:
+            pieces = self._fused.get(key)
+            if pieces is None:
+                pieces = fuse(self._expand(name), self.cfg.sources, self.namespace, name)
+                self._fused[key] = pieces
+            for piece in pieces:
+                if callable(piece):
+                    piece()
+                else:
+                    msg = self._do(*piece) or msg
+        except:
+            reason = str(sys.exc_info()[1]).replace("'",'"')
+            msg = 'Macro ' + name + ' caused an exception\n-> ' + reason + '\n'
+        return msg
+
+class StackView(object):
+    """The formatted top of an Engine's stack, for the prompt.
+
+    Only the top options['window'] items are shown (all of them if the
+    window is 0), and each formatted string is kept against the Decimal
+    it came from, so redrawing after a command formats only the new
+    items, until fix_digits or the precision changes.
+
+    >>> calc = Engine()
+    >>> calc.stack.put(*map(Decimal, '12345'))
+    >>> calc.options.update(fix_digits=0, window=3)
+    >>> view = StackView(calc)
+    >>> view.lines()
+    ['... 2 more', '3', '4', '5']
+    >>> calc.run('6')
+    ''
+    >>> view.lines(), view.formatted
+    (['... 3 more', '4', '5', '6'], 1)
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.settings = None
+        self.memo = {}          # id(item) -> (item, formatted string)
+        self.formatted = 0      # how many items the last call had to format
+
+    def lines(self):
+        o = self.engine.options
+        stack = self.engine.stack
+        settings = (o['fix_digits'], o['precision'], getcontext().prec)
+        if settings != self.settings:
+            self.settings = settings
+            self.memo = {}
+
+        window = int(o.get('window', 0)) or len(stack)
+        items = stack[-window:] if window < len(stack) else list(stack)
+        memo, fresh = self.memo, {}
+        self.formatted = 0
+        for x in items:
+            entry = memo.get(id(x))
+            if entry is None or entry[0] is not x:
+                entry = (x, self.engine.format(x))
+                self.formatted += 1
+            fresh[id(x)] = entry
+        self.memo = fresh       # holding the items keeps their ids unique
+
+        lines = [fresh[id(x)][1] for x in items]
+        if len(stack) > len(items):
+            lines.insert(0, '... %d more' % (len(stack) - len(items)))
+        return lines
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Run maynard RPN programs without Vim.')
+    parser.add_argument('-c', '--config', default=DEFAULT_CONFIG,
+                        help='the maynard config file (default %(default)s)')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='only write what the copy char asks for')
+    parser.add_argument('files', nargs='*', help='files of programs (default stdin)')
+    args = parser.parse_args(argv)
+
+    out = sys.stdout
+    calc = Engine(load_config(args.config), copy=lambda lines: out.write('\n'.join(lines) + '\n'))
+    copy_pattern = re.compile(r'(?:\A|\s)%s' % re.escape(calc.options['copy_char']))
+    streams = [open(f) for f in args.files] or [sys.stdin]
+    for stream in streams:
+        for line in stream:
+            line = line.strip()
+            if not line or line in "quit bye exit".split():
+                continue
+            msg = calc.run(line)
+            if msg:
+                sys.stderr.write(msg)
+            if not args.quiet and not copy_pattern.search(line) and calc.stack:
+                out.write(calc.format(calc.stack[-1]) + '\n')
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+# Reading numbers from a range of lines onto the maynard stack
+#
+# The lines are read a chunk at a time (a Vim range can be sliced without
+# copying the whole buffer), the numbers in each chunk are found with one
+# compiled pattern, and each chunk goes onto the stack with one extend.
+# You can take every number on the line, only some of the columns, or
+# only what a regular expression picks out.
+
+import re
+from decimal import Decimal
+from decimal_tools import looks_like_a_number, NUMBER
+
+JUNK = '_,;$£()'
+CHUNK_SIZE = 2000
+
+# a Decimal constructor string standing on its own between spaces
+_number_pattern = re.compile(r'(?<!\S)%s(?!\S)' % NUMBER)
+
+def parse_columns(spec):
+    """Turn a column option like "2,4" or 3 into a list of 0-based indexes.
+
+    0, "all", or "none" mean every column, which we show as None.
+
+    >>> parse_columns('2,4'), parse_columns(3), parse_columns(0)
+    ([1, 3], [2], None)
+    """
+    columns = [int(c) - 1 for c in str(spec).replace(',', ' ').split()
+               if c.isdigit() and int(c) > 0]
+    return columns or None
+
+def numbers_in(lines, columns=None, sep=None, pattern=None):
+    """Generate the Decimals in some lines of text.
+
+    With no other arguments this takes every word that looks like a number
+    once the characters in JUNK are removed (so 1,234 and $(5) count).
+    columns is a list of 0-based fields, split at sep (or at white space);
+    pattern is a compiled regex whose first group (or whole match, if it
+    has no groups) is the number.
+
+    >>> lines = ['a 1,234 x 2.5', 'b 3 y $(4)', 'c bad z -1e3']
+    >>> [str(x) for x in numbers_in(lines)]
+    ['1234', '2.5', '3', '4', '-1E+3']
+    >>> [str(x) for x in numbers_in(lines, columns=[3])]
+    ['2.5', '4', '-1E+3']
+    >>> [str(x) for x in numbers_in(['1,2,3', '4,5,6'], columns=[0, 2], sep=',')]
+    ['1', '3', '4', '6']
+    >>> [str(x) for x in numbers_in(lines, pattern=re.compile(r'[xyz] (\S+)'))]
+    ['2.5', '4', '-1E+3']
+    """
+    find = _number_pattern.findall
+    for line in lines:
+        if pattern is not None:
+            words = [m.group(m.re.groups and 1).translate(None, JUNK)
+                     for m in pattern.finditer(line)]
+        elif columns is not None:
+            fields = line.split(sep)
+            words = [fields[c].translate(None, JUNK) for c in columns if c < len(fields)]
+        else:
+            for word in find(line.translate(None, JUNK)):
+                yield Decimal(word)
+            continue
+        for word in words:
+            if looks_like_a_number(word.strip()):
+                yield Decimal(word.strip())
+
+def import_range(lines, stack, chunk_size=CHUNK_SIZE, progress=None, **selection):
+    """Push the numbers in lines onto stack, a chunk of lines at a time.
+
+    lines is anything that can be sliced, like a Vim range; progress, if
+    given, is called as progress(lines_done, total_lines) after each
+    chunk.  The other keywords are passed on to numbers_in.  Returns
+    how many numbers were pushed.
+
+    >>> from maynard_stack import Stack
+    >>> s, seen = Stack(), []
+    >>> import_range(['%d' % i for i in range(5)], s, chunk_size=2,
+    ...              progress=lambda done, total: seen.append(done))
+    5
+    >>> seen, s[-2:]
+    ([2, 4, 5], [Decimal('3'), Decimal('4')])
+    """
+    total = len(lines)
+    count = 0
+    for start in range(0, total, chunk_size):
+        batch = list(numbers_in(lines[start:start+chunk_size], **selection))
+        stack.extend(batch)
+        count += len(batch)
+        if progress is not None:
+            progress(min(start+chunk_size, total), total)
+    return count
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
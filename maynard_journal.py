@@ -0,0 +1,200 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+# Saving the maynard stack and options between sessions
+#
+# Instead of writing the whole of maynard.cfg back when you quit, each
+# change is appended to a journal next to it (maynard.cfg.journal) as
+# soon as the line that made it has been run, so that saving costs no
+# more than the change itself and a crash loses nothing.  The records
+# are lines of text:
+#
+#   - 3             take 3 items off the stack
+#   + 1.5 2 3.25    push some items
+#   o fix_digits 4  set an option
+#   m hyp dup * swap dup * + sqrt
+#                   define a macro (with nothing after the name to remove it)
+#   !               start again with an empty stack
+#
+# When the journal gets long compared with the stack it describes, it
+# is compacted: a fresh file with one "!" and the current state in it
+# is written alongside and renamed over the old one.
+
+import os
+from decimal import Decimal, InvalidOperation
+
+COMPACT_AFTER = 500     # records, and at least twice the size of the stack
+ITEMS_PER_LINE = 20
+
+def _option_value(text):
+    """Read an option value the way the config does: an int if it can be."""
+    try:
+        return int(text)
+    except ValueError:
+        return text
+
+class Journal(object):
+    """An append-only record of a stack and its options, kept in a file.
+
+    >>> import tempfile, shutil
+    >>> from maynard_stack import Stack
+    >>> folder = tempfile.mkdtemp()
+    >>> path = os.path.join(folder, 'maynard.cfg.journal')
+    >>> s, o = Stack(map(Decimal, '123')), {'fix_digits': 0}
+    >>> j = Journal(path)
+    >>> j.replay()
+    >>> j.start(s, o, {})
+    >>> s.get(2); s.put(Decimal(5)); o['fix_digits'] = 4
+    [Decimal('3'), Decimal('2')]
+    >>> j.record(s.changes(), o, {'double': '2 *'})
+    >>> print open(path).read(),
+    !
+    + 1 2 3
+    o fix_digits 0
+    - 2
+    + 5
+    o fix_digits 4
+    m double 2 *
+    >>> Journal(path).replay()
+    ([Decimal('1'), Decimal('5')], {'fix_digits': 4}, {'double': '2 *'})
+    >>> j.compact()
+    >>> print open(path).read(),
+    !
+    + 1 5
+    o fix_digits 4
+    m double 2 *
+
+    A record cut short by a crash is left out, and the journal is written
+    afresh before anything is added after it:
+
+    >>> with open(path, 'ab') as f: f.write('+ 4')
+    >>> j = Journal(path); j.replay()
+    ([Decimal('1'), Decimal('5')], {'fix_digits': 4}, {'double': '2 *'})
+    >>> s = Stack(map(Decimal, '15')); j.start(s, o, {'double': '2 *'})
+    >>> s.get(); j.record(s.changes(), o, {'double': '2 *'})
+    Decimal('5')
+    >>> Journal(path).replay()
+    ([Decimal('1')], {'fix_digits': 4}, {'double': '2 *'})
+    >>> shutil.rmtree(folder)
+    """
+    def __init__(self, path, compact_after=COMPACT_AFTER):
+        self.path = path
+        self.compact_after = compact_after
+        self.records = 0
+        self.stack = None
+        self.options = {}
+        self.macros = {}
+        self.file = None
+        self.torn = False       # whether the last line was cut short
+
+    def replay(self):
+        """Return (stack items, options, macros) from the journal, or None if there is none.
+
+        A last line cut short by a crash is ignored, and so is anything else
+        that does not make sense.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                text = f.read()
+        except IOError:
+            return None
+
+        stack, options, macros, records = [], {}, {}, 0
+        self.torn = False
+        for line in text.splitlines(True):
+            if not line.endswith('\n'):
+                self.torn = True
+                break
+            kind, _, rest = line.rstrip('\n').partition(' ')
+            try:
+                if kind == '+':
+                    stack.extend(Decimal(x) for x in rest.split())
+                elif kind == '-':
+                    del stack[len(stack)-int(rest):]
+                elif kind == 'o':
+                    key, _, value = rest.partition(' ')
+                    options[key] = _option_value(value)
+                elif kind == 'm':
+                    name, _, text = rest.partition(' ')
+                    if text:
+                        macros[name] = text
+                    else:
+                        macros.pop(name, None)
+                elif kind == '!':
+                    del stack[:]
+                else:
+                    continue
+            except (ValueError, InvalidOperation):
+                continue
+            records += 1
+        self.records = records
+        return stack, options, macros
+
+    def start(self, stack, options, macros):
+        """Begin recording the stack, options, and macros given, which
+        are written out afresh if they are not what the journal says, or
+        if its last line was cut short (so that we do not append to it)."""
+        self.stack = stack
+        replayed = self.replay()
+        self.options = dict(options)
+        self.macros = dict(macros)
+        if replayed is None or self.torn or replayed != (list(stack), options, macros):
+            self.compact()
+        stack.mark()
+
+    def record(self, change, options, macros):
+        """Append a change to the stack, as (items dropped, items pushed)
+        from Stack.changes(), and any options or macros that have been set."""
+        dropped, pushed = change
+        lines = []
+        if dropped:
+            lines.append('- %d\n' % len(dropped))
+        lines.extend(self._pushes(pushed))
+        for key in sorted(options):
+            if self.options.get(key, self) != options[key]:
+                lines.append('o %s %s\n' % (key, options[key]))
+                self.options[key] = options[key]
+        for name in sorted(set(macros) | set(self.macros)):
+            if self.macros.get(name) != macros.get(name):
+                lines.append(('m %s %s' % (name, macros.get(name, ''))).rstrip() + '\n')
+        self.macros = dict(macros)
+        if not lines:
+            return
+
+        self.records += len(lines)
+        if self.records > max(self.compact_after, 2*len(self.stack)):
+            self.compact()
+            return
+        if self.file is None:
+            self.file = open(self.path, 'ab')
+        self.file.writelines(lines)
+        self.file.flush()
+
+    def compact(self):
+        """Replace the journal with one that just sets up the present state."""
+        lines = ['!\n']
+        lines.extend(self._pushes(list(self.stack)))
+        lines.extend('o %s %s\n' % (key, self.options[key]) for key in sorted(self.options))
+        lines.extend('m %s %s\n' % (name, self.macros[name]) for name in sorted(self.macros))
+        self.close()
+        temp_file = self.path + '.new'
+        with open(temp_file, 'wb') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(temp_file, self.path)
+        self.records = len(lines)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    @staticmethod
+    def _pushes(items):
+        for i in range(0, len(items), ITEMS_PER_LINE):
+            yield '+ %s\n' % ' '.join(str(x) for x in items[i:i+ITEMS_PER_LINE])
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,217 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+# Compiling maynard macros
+#
+# A macro is a list of tokens, like "dup * swap dup * + sqrt".  Rather
+# than run each command in turn, pushing and popping as it goes, we
+# write the whole list out as one Python function.  Most commands have
+# the shape "a,b=get(2); <statements>; put(<values>)", so each get() can
+# take its values straight from the temporaries the earlier put()s made,
+# and the stack itself is only touched at the start (for operands the
+# macro does not supply) and at the end.  A command of any other shape
+# is copied in as it is, after putting back what is pending.  Tokens
+# that are not commands at all (fix, units, the copy char, ...) are left
+# for the engine, which runs the compiled pieces and these in order.
+# Since most gets never happen, the operands of the last command are
+# put into last_operands before anything else can look at them, so lx
+# and friends see the same as they would after the commands one by one.
+
+import re
+import ast
+
+_get_pattern = re.compile(r'\A\s*(\w+(?:\s*,\s*\w+)*)\s*=\s*get\((\d*)\)\s*\Z')
+_stack_names = re.compile(r'\b(get|put|take|stack|last_operands)\b')
+
+def _split(source):
+    """Split a command into its statements, or return None if we cannot."""
+    statements = [s.strip() for s in source.split(';') if s.strip()]
+    for s in statements:
+        try:
+            compile(s, '<macro>', 'exec')
+        except SyntaxError:
+            return None
+    return statements
+
+def _put_count(statement):
+    """Return how many values a "put(...)" statement pushes, or None."""
+    try:
+        tree = ast.parse(statement)
+    except SyntaxError:
+        return None
+    if len(tree.body) != 1 or not isinstance(tree.body[0], ast.Expr):
+        return None
+    call = tree.body[0].value
+    if not (isinstance(call, ast.Call) and isinstance(call.func, ast.Name)
+            and call.func.id == 'put' and not call.keywords
+            and not getattr(call, 'starargs', None) and not getattr(call, 'kwargs', None)):
+        return None
+    if any(type(a).__name__ == 'Starred' for a in call.args):
+        return None
+    return len(call.args)
+
+def analyse(source):
+    """Return (names got, body statements, put values, how many) for a
+    command that only uses the stack through a leading get and a trailing
+    put, or None for any other command.
+
+    >>> analyse('a,b=get(2);put(a+b)')
+    (['a', 'b'], [], 'a+b', 1)
+    >>> analyse('a=get(); put(a,a);')
+    (['a'], [], 'a,a', 2)
+    >>> analyse('put(pi())')
+    ([], [], 'pi()', 1)
+    >>> analyse('k,v=get(2);memory[int(k)]=v')
+    (['k', 'v'], ['memory[int(k)]=v'], None, 0)
+    >>> print analyse('get(len(stack))'), analyse('a,b=get(2);put(*range(a,b))')
+    None None
+    """
+    statements = _split(source)
+    if not statements:
+        return None
+    names = []
+    m = _get_pattern.match(statements[0])
+    if m is not None:
+        names = [n.strip() for n in m.group(1).split(',')]
+        if len(names) != int(m.group(2) or 1):
+            return None
+        statements = statements[1:]
+
+    values, count = None, 0
+    if statements and statements[-1].startswith('put('):
+        count = _put_count(statements[-1])
+        if count is None:
+            return None
+        values = statements[-1][4:].rstrip()[:-1]
+        statements = statements[:-1]
+
+    for s in statements + [values or '']:
+        if _stack_names.search(s):
+            return None
+    return names, statements, values, count
+
+class _Writer(object):
+    """Write out the body of a fused function, keeping track of the
+    values that would be on the stack as temporaries."""
+    def __init__(self):
+        self.lines = []
+        self.pending = []       # temporaries standing for the top of the stack
+        self.count = 0
+        self.last = None        # temporaries for the last command's operands, top first
+
+    def temporary(self):
+        self.count += 1
+        return '_t%d' % self.count
+
+    def flush(self):
+        if self.pending:
+            self.lines.append('put(%s)' % ', '.join(self.pending))
+            self.pending = []
+
+    def settle_last(self):
+        """Set last_operands as the last command would have left it."""
+        if self.last is not None:
+            self.lines.append('last_operands[:] = [%s]' % ', '.join(reversed(self.last)))
+            self.last = None
+
+    def number(self, text):
+        t = self.temporary()
+        self.lines.append("%s = Decimal('%s')" % (t, text))
+        self.pending.append(t)
+
+    def pop(self, n):
+        """Return n temporaries for the top n values, top first."""
+        got = self.pending[::-1][:n]
+        self.pending = self.pending[:max(len(self.pending)-n, 0)]
+        if len(got) < n:
+            pulled = [self.temporary() for i in range(n - len(got))]
+            self.lines.append('%s = get(%d)' % (', '.join(pulled), len(pulled)))
+            got.extend(pulled)
+        return got
+
+    def command(self, source):
+        shape = analyse(source)
+        if shape is None:
+            self.flush()
+            self.settle_last()
+            self.lines.append(source.strip())
+            return
+        names, body, values, count = shape
+        if names:
+            self.last = self.pop(len(names))
+            self.lines.append('%s = %s' % (', '.join(names), ', '.join(self.last)))
+        self.lines.extend(body)
+        if count:
+            made = [self.temporary() for i in range(count)]
+            self.lines.append('%s = %s' % (', '.join(made), values))
+            self.pending.extend(made)
+
+def fuse(tokens, sources, namespace, name='macro'):
+    """Compile a list of (kind, text) tokens into a list of pieces: each
+    is either a function that runs a stretch of commands and numbers, or
+    a (kind, text) token that the engine has to deal with itself.
+
+    sources maps command names to their source text; the functions are
+    made with namespace as their globals, and name is only for tracebacks.
+
+    >>> from decimal import Decimal
+    >>> from maynard_stack import Stack
+    >>> s = Stack(map(Decimal, '34'))
+    >>> ns = {'Decimal': Decimal, 'get': s.get, 'put': s.put, 'last_operands': s.last_operands}
+    >>> sources = {'dup': 'a=get(); put(a,a);', '*': 'a,b=get(2);put(a*b)',
+    ...            'swap': 'a,b=get(2);put(a,b);', '+': 'a,b=get(2);put(a+b)',
+    ...            'sqrt': 'a=get();put(a.sqrt())'}
+    >>> tokens = [('word', w) for w in 'dup * swap dup * + sqrt'.split()]
+    >>> pieces = fuse(tokens, sources, ns, 'hyp')
+    >>> print pieces[0].source
+    def macro():
+        _t1 = get(1)
+        a = _t1
+        _t2, _t3 = a,a
+        a, b = _t3, _t2
+        _t4 = a*b
+        _t5 = get(1)
+        a, b = _t4, _t5
+        _t6, _t7 = a,b
+        a = _t7
+        _t8, _t9 = a,a
+        a, b = _t9, _t8
+        _t10 = a*b
+        a, b = _t10, _t6
+        _t11 = a+b
+        a = _t11
+        _t12 = a.sqrt()
+        put(_t12)
+        last_operands[:] = [_t11]
+    >>> pieces[0](); list(s), s.last_operands
+    ([Decimal('5')], [Decimal('25')])
+    """
+    pieces = []
+    writer = _Writer()
+
+    def finish():
+        writer.flush()
+        writer.settle_last()
+        if writer.lines:
+            text = 'def macro():\n%s\n' % ''.join('    %s\n' % line for line in writer.lines)
+            scope = {}
+            exec(compile(text, 'macro %s' % name, 'exec'), namespace, scope)
+            function = scope['macro']
+            function.source = text.rstrip()
+            pieces.append(function)
+        writer.__init__()
+
+    for kind, text in tokens:
+        if kind == 'number':
+            writer.number(text)
+        elif text in sources:
+            writer.command(sources[text])
+        else:
+            finish()
+            pieces.append((kind, text))
+    finish()
+    return pieces
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,180 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+# The maynard stack
+
+from collections import deque
+from itertools import islice
+from decimal import Decimal
+
+class Stack(deque):
+    """A deque of Decimals with the top of the stack at the right hand end.
+
+    Push and pop are O(1), get(k) is O(k) whatever the depth of the stack,
+    and stack[-1], stack[-2], ... reach the top items in O(1) too.
+
+    >>> s = Stack(map(Decimal, '123'))
+    >>> s.get()
+    Decimal('3')
+    >>> s.get(3)
+    [Decimal('2'), Decimal('1'), Decimal('0')]
+    >>> s.last_operands
+    [Decimal('0'), Decimal('1'), Decimal('2')]
+    >>> s.put(Decimal(4), Decimal(5))
+    >>> s[-1], len(s)
+    (Decimal('5'), 2)
+    >>> s[-2:]
+    [Decimal('4'), Decimal('5')]
+
+    The stack also keeps track of how far down it has been disturbed since
+    mark() was called, so that changes() can say what happened without
+    comparing the whole stack.
+
+    >>> s.mark()
+    >>> s.get(2); s.put(Decimal(9))
+    [Decimal('5'), Decimal('4')]
+    >>> s.changes()
+    ([Decimal('4'), Decimal('5')], [Decimal('9')])
+    """
+    def __init__(self, items=()):
+        deque.__init__(self, items)
+        # the operands of the last get(), in stack order, bottom first;
+        # updated in place so that other names for it stay current
+        self.last_operands = []
+        self.mark()
+
+    def mark(self):
+        """Start counting changes from here."""
+        self.low = len(self)
+        self.dropped = []       # the marked items taken off, top first
+
+    def changes(self):
+        """Return (the items that came off, the items now above them)
+        since mark(), both in stack order, which is the least that turns
+        the old stack into the new one."""
+        pushed = self[self.low-len(self):] if self.low < len(self) else []
+        return self.dropped[::-1], pushed
+
+    def _dropping(self):
+        """Note that everything left of the marked stack may change."""
+        self.dropped.extend(reversed(list(islice(self, self.low))))
+        self.low = 0
+
+    def pop(self):
+        item = deque.pop(self)
+        if len(self) < self.low:
+            self.low = len(self)
+            self.dropped.append(item)
+        return item
+
+    def __getitem__(self, i):
+        if not isinstance(i, slice):
+            return deque.__getitem__(self, i)
+        if i.start is not None and i.start < 0 and i.stop is None and i.step is None:
+            top = list(islice(reversed(self), -i.start))   # just the top few
+            top.reverse()
+            return top
+        return list(self)[i]
+
+    def get(self, n=1):
+        """Return a list of items off the stack
+        or just one...
+
+        If the stack is too short it is padded with zeros at the bottom.
+        Usage: a,b=get(2) etc.  Note: a=get(1) does *not* return a list...
+        """
+        n = int(n)
+        if len(self) < n:
+            self.extendleft([Decimal(0)]*(n-len(self)))
+        last = self.last_operands
+        del last[:]
+        if n<1:
+            return None
+        pop = deque.pop
+        if n==1:
+            a = pop(self)
+            last.append(a)
+        else:
+            a = [pop(self) for i in range(n)]
+            last.extend(reversed(a))
+        if len(self) < self.low:
+            self.dropped.extend(last[:self.low-len(self)][::-1])
+            self.low = len(self)
+        return a
+
+    def take(self, n=0):
+        """Take the top n items off the stack, or all of them if n < 1,
+        and return them as a list in stack order, bottom first.
+
+        >>> s = Stack(map(Decimal, '123'))
+        >>> s.take(2), s.take(0), len(s)
+        ([Decimal('2'), Decimal('3')], [Decimal('1')], 0)
+        """
+        n = int(n)
+        if n < 1 or n > len(self):
+            n = len(self)
+        if n == 0:
+            del self.last_operands[:]
+            return []
+        items = self.get(n)
+        if n == 1:
+            return [items]
+        items.reverse()
+        return items
+
+    def put(self, *items):
+        """Push the items, so that the last one ends up on top."""
+        self.extend(items)
+
+def _from_the_bottom(name):
+    """Wrap a deque method that may change any item on the stack."""
+    method = getattr(deque, name)
+    def wrapper(self, *args):
+        self._dropping()
+        return method(self, *args)
+    wrapper.__name__ = name
+    return wrapper
+
+for _name in ('appendleft', 'extendleft', 'popleft', 'clear', 'remove',
+              'reverse', 'rotate', '__setitem__', '__delitem__'):
+    setattr(Stack, _name, _from_the_bottom(_name))
+
+class History(object):
+    """Steps that can be undone and redone, keeping at most limit of them.
+
+    >>> h = History(2)
+    >>> for step in 'abc': h.record(step)
+    >>> h.undo(), h.undo(), h.undo()
+    ('c', 'b', None)
+    >>> h.redo()
+    'b'
+    >>> h.record('d'); h.redo()
+    """
+    def __init__(self, limit=100):
+        self.limit = limit
+        self.done = deque()
+        self.undone = []
+
+    def record(self, step):
+        self.done.append(step)
+        while len(self.done) > max(self.limit, 0):
+            self.done.popleft()
+        del self.undone[:]
+
+    def undo(self):
+        if not self.done:
+            return None
+        step = self.done.pop()
+        self.undone.append(step)
+        return step
+
+    def redo(self):
+        if not self.undone:
+            return None
+        step = self.undone.pop()
+        self.done.append(step)
+        return step
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,153 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+# Unit conversion for maynard
+#
+# Every unit is reduced to a signature of base dimensions with powers,
+# like (('LENGTH', 1), ('TIME', -1)), and a Decimal factor that takes a
+# value in the unit to the product of the base units.  Dimensions that
+# are made of others are declared in the config with d: lines, such as
+# "d: VOLUME LENGTH*LENGTH*LENGTH 0.001" where the last figure is the
+# size of the first unit of the dimension (here a litre) in base units.
+# Any other dimension is a base dimension in its own right.
+#
+# Compound units like km/hour or sqft*ft are worked out when first seen
+# and then kept, and so is the ratio for each pair of units converted,
+# so a conversion costs one multiply.  Units with an offset, like DF and
+# DC, convert by (x + offset) * factor, and cannot be compounded.
+
+import re
+from decimal import Decimal, getcontext
+from cache_tools import LRUCache
+
+class Unit(object):
+    """A unit: its signature of base dimensions, a factor, and an offset."""
+    __slots__ = ('name', 'signature', 'factor', 'offset')
+
+    def __init__(self, name, signature, factor, offset=None):
+        self.name = name
+        self.signature = signature
+        self.factor = factor
+        self.offset = offset
+
+    def __getstate__(self):
+        return (self.name, self.signature, self.factor, self.offset)
+
+    def __setstate__(self, state):
+        self.name, self.signature, self.factor, self.offset = state
+
+def _combine(*signatures):
+    """Add up the powers in some (dimension, power) signatures."""
+    powers = {}
+    for signature, sign in signatures:
+        for dimension, power in signature:
+            powers[dimension] = powers.get(dimension, 0) + sign*power
+    return tuple(sorted((d, p) for d, p in powers.items() if p))
+
+_compound_pattern = re.compile(r'([*/]?)([^*/]+)')
+
+class UnitIndex(object):
+    """All the units in a config, indexed for quick conversion.
+
+    units is the name -> (dimension, name, factor, offset) table from
+    the config, and dimensions is name -> (expression, scale) from d: lines.
+
+    >>> from maynard_config import parse_config
+    >>> cfg = parse_config(['d: SPEED LENGTH/TIME', 'u: LENGTH M 1', 'u: LENGTH KM 1000',
+    ...                     'u: LENGTH MI 0.0254*63360', 'u: TIME HOUR 3600',
+    ...                     'u: SPEED MPH 63360*0.0254/3600', 'u: TEMPERATURE K 1',
+    ...                     'u: TEMPERATURE DF 5/9 459.67', 'u: TEMPERATURE DC 1 273.15'])
+    >>> index = cfg.unit_index
+    >>> print index.convert(Decimal(100), 'km/hour', 'mph')
+    62.13711922373339696174341844
+    >>> print index.convert(Decimal(212), 'df', 'dc')
+    100.0000000000000000000000000
+    >>> print index.convert(Decimal(-40), 'dc', 'df')
+    -40.0000000000000000000000000
+    >>> index.lookup('km/hour').signature
+    (('LENGTH', 1), ('TIME', -1))
+    >>> print index.lookup('furlong')
+    None
+    >>> index.convert(Decimal(1), 'km', 'hour')
+    Traceback (most recent call last):
+    ...
+    ValueError: Cannot convert km to hour
+    """
+    def __init__(self, units, dimensions):
+        self.dimensions = {}
+        for name in dimensions:
+            self._dimension(name, dimensions)
+
+        self.units = {}
+        for key, (dimension, name, factor, offset) in units.items():
+            signature, scale = self._dimension(dimension, dimensions)
+            self.units[key] = Unit(key, signature, factor*scale, offset)
+
+        self._compounds = LRUCache(256)
+        self._ratios = LRUCache(256)
+
+    def _dimension(self, name, dimensions, seen=()):
+        """Return (signature, scale) for a named dimension."""
+        if name in self.dimensions:
+            return self.dimensions[name]
+        if name not in dimensions or name in seen:
+            result = (((name, 1),), Decimal(1))
+        else:
+            expression, scale = dimensions[name]
+            parts = []
+            for op, part in _compound_pattern.findall(expression):
+                signature, part_scale = self._dimension(part, dimensions, seen + (name,))
+                parts.append((signature, -1 if op == '/' else 1))
+                scale = scale / part_scale if op == '/' else scale * part_scale
+            result = (_combine(*parts), scale)
+        self.dimensions[name] = result
+        return result
+
+    def __contains__(self, token):
+        return self.lookup(token) is not None
+
+    def lookup(self, token):
+        """Return the Unit for a token like "ft" or "km/hour", or None."""
+        unit = self.units.get(token)
+        if unit is not None or ('/' not in token and '*' not in token):
+            return unit
+
+        missing = object()
+        unit = self._compounds.get(token, missing)
+        if unit is missing:
+            unit = self._compound(token)
+            self._compounds[token] = unit
+        return unit
+
+    def _compound(self, token):
+        parts, factor = [], Decimal(1)
+        for op, name in _compound_pattern.findall(token):
+            unit = self.units.get(name)
+            if unit is None or unit.offset is not None:
+                return None
+            parts.append((unit.signature, -1 if op == '/' else 1))
+            factor = factor / unit.factor if op == '/' else factor * unit.factor
+        return Unit(token, _combine(*parts), factor)
+
+    def convert(self, value, source, target):
+        """Convert value from the unit named source to the unit named target."""
+        a, b = self.lookup(source), self.lookup(target)
+        if a is None or b is None or a.signature != b.signature:
+            raise ValueError('Cannot convert %s to %s' % (source, target))
+        if a.offset is None and b.offset is None:
+            key = (source, target, getcontext().prec)
+            ratio = self._ratios.get(key)
+            if ratio is None:
+                ratio = a.factor / b.factor
+                self._ratios[key] = ratio
+            return value * ratio
+        if a.offset is not None:
+            value += a.offset
+        value = value * a.factor / b.factor
+        if b.offset is not None:
+            value -= b.offset
+        return value
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
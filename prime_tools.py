@@ -0,0 +1,394 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+# Primes: testing, searching, and factoring integers
+
+from __future__ import division
+import random
+
+try:
+    from math import gcd
+except ImportError:
+    from fractions import gcd
+
+def primes_below(n):
+    """Return a list of the primes less than n.
+
+    >>> primes_below(30)
+    [2, 3, 5, 7, 11, 13, 17, 19, 23, 29]
+    """
+    flags = bytearray([1])*n
+    flags[:2] = bytearray(2)
+    for i in range(2, int(n**0.5)+1):
+        if flags[i]:
+            flags[i*i::i] = bytearray(len(range(i*i, n, i)))
+    return [i for i in range(n) if flags[i]]
+
+SIEVE_LIMIT = 1000
+SMALL_PRIMES = primes_below(SIEVE_LIMIT)
+
+# The first 13 primes as bases make Miller-Rabin exact below this bound;
+# above it we use more bases and the chance of a mistake is negligible.
+_DETERMINISTIC_LIMIT = 3317044064679887385961981
+
+def _strong_probable_prime(n, a, d, s):
+    """Miller-Rabin test of odd n to base a, where n-1 = d*2^s with d odd."""
+    x = pow(a, d, n)
+    if x == 1 or x == n-1:
+        return True
+    for i in range(s-1):
+        x = x*x % n
+        if x == n-1:
+            return True
+    return False
+
+def _integer(n, name):
+    """Return n as an int, or raise ValueError if it is not a whole number."""
+    if n != int(n):
+        raise ValueError('%s() only accepts integral values' % name)
+    return int(n)
+
+def isprime(n):
+    """Return True if the integer n is prime.
+
+    Trial division by the small primes, then Miller-Rabin.
+
+    >>> isprime(1), isprime(2), isprime(91), isprime(97)
+    (False, True, False, True)
+    >>> isprime(4294967291)
+    True
+    >>> isprime(3825123056546413051)
+    False
+    >>> isprime(2**89-1)
+    True
+    >>> isprime(7.0)
+    True
+    >>> isprime(7.5)
+    Traceback (most recent call last):
+    ...
+    ValueError: isprime() only accepts integral values
+    """
+    n = _integer(n, 'isprime')
+    if n < 2:
+        return False
+    for p in SMALL_PRIMES:
+        if n % p == 0:
+            return n == p
+    if n < SIEVE_LIMIT*SIEVE_LIMIT:
+        return True
+
+    d, s = n-1, 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+    bases = SMALL_PRIMES[:13] if n < _DETERMINISTIC_LIMIT else SMALL_PRIMES[:40]
+    for a in bases:
+        if not _strong_probable_prime(n, a, d, s):
+            return False
+    return True
+
+def nextprime(n):
+    """Return the smallest prime greater than n.
+
+    >>> nextprime(0), nextprime(2), nextprime(13), nextprime(4294967279)
+    (2, 3, 17, 4294967291)
+    >>> nextprime(2.5)
+    Traceback (most recent call last):
+    ...
+    ValueError: nextprime() only accepts integral values
+    """
+    n = _integer(n, 'nextprime')
+    if n < 2:
+        return 2
+    n += 1 + n % 2    # the next odd number
+    while not isprime(n):
+        n += 2
+    return n
+
+def iroot(n, k):
+    """Return the integer k-th root of n >= 0, the largest r with r**k <= n.
+
+    >>> iroot(26, 3), iroot(27, 3), iroot(10**40, 2) == 10**20
+    (2, 3, True)
+    """
+    if n < 2:
+        return n
+    r = 1 << -(-n.bit_length() // k)     # a power of two at least the root
+    while True:
+        s = ((k-1)*r + n // r**(k-1)) // k
+        if s >= r:
+            return r
+        r = s
+
+def _perfect_power(n):
+    """Return (r, k) with n = r**k and k > 1 as large as it can be, or
+    None if n is not a perfect power."""
+    for k in primes_below(n.bit_length()):
+        r = iroot(n, k)
+        if r**k == n:
+            power = _perfect_power(r)
+            return (r, k) if power is None else (power[0], power[1]*k)
+    return None
+
+RHO_BUDGET = 1 << 12     # steps of rho before we turn to elliptic curves
+
+def _brent(n, budget=None):
+    """Return a non-trivial factor of the odd composite n, or None if
+    budget steps were not enough.
+
+    Pollard's rho method with Brent's cycle finding, multiplying the
+    differences together so that we only take a gcd every m steps.
+    """
+    m = 64
+    while True:
+        y, c = random.randrange(1, n), random.randrange(1, n)
+        g, r, q = 1, 1, 1
+        while g == 1:
+            if budget is not None and r > budget:
+                return None
+            x = y
+            for i in range(r):
+                y = (y*y + c) % n
+            k = 0
+            while k < r and g == 1:
+                ys = y
+                for i in range(min(m, r-k)):
+                    y = (y*y + c) % n
+                    q = q*abs(x-y) % n
+                g = gcd(q, n)
+                k += m
+            r *= 2
+        if g == n:      # overshot, so back up and go one step at a time
+            g = 1
+            while g == 1:
+                ys = (ys*ys + c) % n
+                g = gcd(abs(x-ys), n)
+        if g != n:
+            return g
+
+def _inverse(a, n):
+    """Return (1/a mod n, 1), or (0, g) with g = gcd(a, n) if there is none."""
+    r0, r1, s0, s1 = n, a % n, 0, 1
+    while r1:
+        q = r0 // r1
+        r0, r1, s0, s1 = r1, r0 - q*r1, s1, s0 - q*s1
+    if r0 != 1:
+        return 0, r0
+    return s0 % n, 1
+
+def _double(x, z, a24, n):
+    s, d = (x+z)*(x+z) % n, (x-z)*(x-z) % n
+    t = s - d
+    return s*d % n, t*(d + a24*t) % n
+
+def _add(x1, z1, x2, z2, xd, zd, n):
+    """Add two points whose difference is (xd:zd)."""
+    u, v = (x1-z1)*(x2+z2), (x1+z1)*(x2-z2)
+    return zd*(u+v)*(u+v) % n, xd*(u-v)*(u-v) % n
+
+def _multiply(k, x, z, a24, n):
+    """Return k times the point (x:z), by Montgomery's ladder."""
+    x1, z1 = x, z
+    x2, z2 = _double(x, z, a24, n)
+    for bit in bin(k)[3:]:
+        if bit == '1':
+            x1, z1 = _add(x2, z2, x1, z1, x, z, n)
+            x2, z2 = _double(x2, z2, a24, n)
+        else:
+            x2, z2 = _add(x1, z1, x2, z2, x, z, n)
+            x1, z1 = _double(x1, z1, a24, n)
+    return x1, z1
+
+# (B1, curves) as the factor we are looking for grows: about 15, 20, 25 digits
+ECM_STAGES = [(2000, 25), (11000, 90), (50000, 300)]
+ECM_D = 210
+_ecm_plans = {}
+
+def _ecm_plan(b1):
+    """Return (the product of the prime powers up to b1, the first m, and
+    for each m from then on the j with a prime m*D +- j up to 100*b1)."""
+    if b1 not in _ecm_plans:
+        b2 = 100*b1
+        primes = primes_below(b2 + ECM_D)
+        k = 1
+        for p in primes:
+            if p > b1:
+                break
+            q = p
+            while q*p <= b1:
+                q *= p
+            k *= q
+        m0 = b1 // ECM_D        # at least 2, as b1 is much bigger than D
+        steps = [[] for m in range(m0, b2 // ECM_D + 2)]
+        for p in primes:
+            if p > b1:
+                m = (p + ECM_D//2) // ECM_D
+                steps[m - m0].append(abs(p - m*ECM_D))
+        _ecm_plans[b1] = k, m0, steps
+    return _ecm_plans[b1]
+
+def _ecm_curve(n, b1):
+    """Try one random Montgomery curve (Suyama's parametrisation) on n,
+    returning a factor or None."""
+    sigma = random.randrange(6, n-1)
+    u, v = (sigma*sigma - 5) % n, 4*sigma % n
+    x, z = pow(u, 3, n), pow(v, 3, n)
+    inverse, g = _inverse(16*x*v, n)
+    if g != 1:
+        return g if g != n else None
+    a24 = pow(v-u, 3, n)*(3*u+v)*inverse % n
+
+    # stage 1: multiply by every prime power up to b1
+    k, m, steps = _ecm_plan(b1)
+    x, z = _multiply(k, x, z, a24, n)
+    g = gcd(z, n)
+    if g != 1:
+        return g if g != n else None
+
+    # stage 2: one more prime q up to 100*b1, with q = m*D +- j, using
+    # x(m*D*Q) = x(j*Q) exactly when q*Q is the identity mod a factor
+    multiples = [None] * (ECM_D//2)
+    x2, z2 = _double(x, z, a24, n)
+    xj, zj, xp, zp = x, z, x, z         # j*Q and (j-2)*Q
+    for j in range(1, ECM_D//2, 2):
+        if j > 1:
+            xj, zj, xp, zp = _add(xj, zj, x2, z2, xp, zp, n) + (xj, zj)
+        multiples[j] = (xj, zj)
+    xs, zs = _multiply(ECM_D, x, z, a24, n)
+    xr, zr = _multiply(m*ECM_D, x, z, a24, n)
+    xo, zo = _multiply((m-1)*ECM_D, x, z, a24, n)
+    product = 1
+    for js in steps:
+        for j in js:
+            xq, zq = multiples[j]
+            product = product*(xr*zq - xq*zr) % n
+        xr, zr, xo, zo = _add(xr, zr, xs, zs, xo, zo, n) + (xr, zr)
+    g = gcd(product, n)
+    return g if 1 < g < n else None
+
+def _ecm(n):
+    """Return a non-trivial factor of the odd composite n, with Lenstra's
+    elliptic curve method, trying larger bounds as curves fail."""
+    stages = ECM_STAGES
+    while True:
+        for b1, curves in stages:
+            for i in range(curves):
+                g = _ecm_curve(n, b1)
+                if g is not None:
+                    return g
+        b1, curves = stages[-1]
+        stages = [(b1*5, curves*3)]
+
+def factorize(n):
+    """Return a sorted list of the prime factors of an integer.
+
+    Small factors come out by trial division; what is left is split
+    until every piece passes isprime(), by taking roots of perfect
+    powers, by Pollard-rho for a while, which finds factors up to about
+    eight digits, and then by elliptic curves.
+
+    >>> print factorize(4294966189)
+    [53197, 80737]
+    >>> print factorize(4294966271)
+    [44617, 96263]
+    >>> print factorize(4294966272)
+    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 3, 23, 89, 683]
+    >>> print factorize(4294966339)
+    [13187, 325697]
+    >>> print factorize(4294966457)
+    [14891, 288427]
+    >>> print factorize(4294966464)
+    [2, 2, 2, 2, 2, 2, 3, 3, 3, 2485513]
+    >>> print factorize(4294966519)
+    [34583, 124193]
+    >>> print factorize(4294966573)
+    [23071, 186163]
+    >>> print factorize(4294966901)
+    [37747, 113783]
+    >>> print factorize(4294966969)
+    [44201, 97169]
+    >>> print factorize(4294966998)
+    [2, 3, 7, 3917, 26107]
+    >>> print factorize(4294967071)
+    [65521, 65551]
+    >>> print factorize(4294967291)
+    [4294967291]
+    >>> print factorize(4294967293)
+    [9241, 464773]
+    >>> print factorize(9)
+    [3, 3]
+    >>> print factorize(-1)
+    -1
+    >>> print factorize(4294966194)
+    [2, 3, 3, 3, 3, 3, 3, 3, 53, 97, 191]
+    >>> print factorize(4294966201)
+    [12197, 352133]
+    >>> print factorize(4294966400)
+    [2, 2, 2, 2, 2, 2, 2, 5, 5, 1342177]
+    >>> print factorize(4294966561)
+    [36067, 119083]
+    >>> print factorize(4294966631)
+    [13729, 312839]
+    >>> print factorize(4294966691)
+    [39241, 109451]
+    >>> print factorize(4294966759)
+    [21649, 198391]
+    >>> print factorize(4294966789)
+    [50411, 85199]
+    >>> print factorize(4294966896)
+    [2, 2, 2, 2, 3, 3, 3, 11, 607, 1489]
+    >>> print factorize(4294967099)
+    [44483, 96553]
+    >>> print factorize(4294967101)
+    [23603, 181967]
+    >>> print factorize(4294967213)
+    [57139, 75167]
+    >>> print factorize(4294967292)
+    [2, 2, 3, 3, 7, 11, 31, 151, 331]
+    >>> print factorize(1000000016000000063)
+    [1000000007, 1000000009]
+    >>> print factorize(10000000019*10000000033*1000003)
+    [1000003, 10000000019, 10000000033]
+    >>> print factorize(2**64-1)
+    [3, 5, 17, 257, 641, 65537, 6700417]
+    >>> print factorize(271828182845909*314159265359057)
+    [271828182845909, 314159265359057]
+    >>> print factorize(1000000000000037**2)
+    [1000000000000037, 1000000000000037]
+    >>> print factorize(2 * 10000000019**3 * 1000003**2)
+    [2, 1000003, 1000003, 10000000019, 10000000019, 10000000019]
+    >>> print factorize(7.5)
+    Traceback (most recent call last):
+    ...
+    ValueError: factorize() only accepts integral values
+    """
+    if n <=1:
+        return n
+
+    n = _integer(n, 'factorize')
+    factors = []
+    for p in SMALL_PRIMES:
+        if p*p > n:
+            break
+        while n % p == 0:
+            factors.append(p)
+            n //= p
+
+    pending = [n] if n > 1 else []
+    while pending:
+        m = pending.pop()
+        if isprime(m):
+            factors.append(int(m))
+            continue
+        power = _perfect_power(m)
+        if power is not None:
+            pending.extend([power[0]]*power[1])
+        else:
+            d = _brent(m, RHO_BUDGET) or _ecm(m)
+            pending.extend((d, m//d))
+    factors.sort()
+    return factors
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -4,8 +4,16 @@ Toby Thurston -- 04 Dec 2014
 """
 
 from __future__ import division, print_function
-from math import sqrt, log, exp, sin, cos, tan, asin, acos, atan, hypot, pi, e, ceil, floor, factorial, fabs, degrees, radians
+from math import sqrt, log, exp, sin, cos, tan, asin, acos, atan, hypot, pi, e, ceil, floor, fabs, degrees, radians, lgamma
+from factorial_tools import fact, comb
+from cache_tools import memoize
+from maynard_config import load_config, DEFAULT_CONFIG
+from decimal import Decimal
 import re
+import sys
+import ast
+import numbers
+import operator
 
 phi = 1.61803398875
 
@@ -29,8 +37,48 @@ def cosd(x):
 def tand(x):
     return sind(x)/cosd(x)
 
+# no whole number we work out may be longer than this many bits
+MAX_BITS = 1 << 16
+
+def power(x, y):
+    '''x**y, but refusing whole numbers too long to work out in good time.
+
+    >>> power(2, 10), power(2.0, 0.5)
+    (1024, 1.4142135623730951)
+    >>> power(9, 9**9)
+    Traceback (most recent call last):
+    ...
+    ValueError: power() result too large
+    '''
+    if (isinstance(x, numbers.Integral) and isinstance(y, numbers.Integral)
+            and abs(x) > 1 and y > 0 and y*log(abs(x), 2) > MAX_BITS):
+        raise ValueError('power() result too large')
+    return x**y
+
+def factorial(n):
+    '''n! for a whole number n, even one written like 4.0, as math.factorial.
+
+    >>> factorial(5), factorial(4.0)
+    (120, 24)
+    >>> factorial(3.5)
+    Traceback (most recent call last):
+    ...
+    ValueError: factorial() only accepts integral values
+    >>> factorial(10**8)
+    Traceback (most recent call last):
+    ...
+    ValueError: factorial() result too large
+    '''
+    if n != int(n):
+        raise ValueError('factorial() only accepts integral values')
+    if n < 0:
+        raise ValueError('factorial() not defined for negative values')
+    if lgamma(n+1)/log(2) > MAX_BITS:
+        raise ValueError('factorial() result too large')
+    return fact(int(n))
+
 def choose(n, k):
-    '''A fast way to calculate binomial coefficients by Andrew Dalke (contrib).
+    '''Binomial coefficients, from the shared factorial_tools.
 
     >>> choose(4,2)
     6
@@ -38,20 +86,299 @@ def choose(n, k):
     0
     >>> choose(20,8)
     125970
+    >>> choose(10**8, 10**7)
+    Traceback (most recent call last):
+    ...
+    ValueError: choose() result too large
     '''
-    if 0 <= k <= n:
-        ntok = 1
-        ktok = 1
-        for t in xrange(1, min(k, n - k) + 1):
-            ntok *= n
-            ktok *= t
-            n -= 1
-        return ntok // ktok
-    return 0
+    if 0 < k < n and (lgamma(n+1) - lgamma(k+1) - lgamma(n-k+1))/log(2) > MAX_BITS:
+        raise ValueError('choose() result too large')
+    return comb(n, k)
+
+# TeX's own lengths, in big points; load_units adds the units in maynard.cfg
+TEX_UNITS = { 'mm': 72/25.4, 'cm': 72/2.54, 'in': 72, 'bp': 1, 'pt': 72/72.27, 'pc': 12*72/72.27 }
+UNITS = dict(TEX_UNITS)
+
+_tex_token = re.compile(r'''
+    (?P<hole>\x00)
+  | (?P<value>\x01)
+  | \\+(?P<command>[A-Za-z]+)
+  | (?P<name>[A-Za-z]+)
+  | (?P<space>\s+)
+  | (?P<backslash>\\+)
+  | (?P<other>.)
+''', re.VERBOSE | re.DOTALL)
+
+_number = re.compile(r'\d+(?:\.\d*)?|\.\d+')
+_hole = re.compile(r'_n\[(\d+)\]')
+
+def translate_template(template):
+    r'''Turn TeX-ish input into Python, in one pass over the tokens.
+
+    The numbers in the input must already have been replaced by \x00, and
+    they come out as _n[0], _n[1], ... so that expressions that differ
+    only in their numbers translate (and compile) the same way.  Named
+    values are replaced by \x01: they come out the same way, but are
+    multiplied by what is next to them as a name would be.
+
+    >>> translate_template('{\x00\\over\x00}\\times\x00!+\x00mm')
+    '((_n[0])/(_n[1]))*factorial(_n[2])+(_n[3]*2.834645669291339)'
+    >>> translate_template('\x00\\sqrt{\x00\\choose\x00}^\x00')
+    '_n[0]*sqrt(choose(_n[1],_n[2]))**_n[3]'
+    >>> translate_template('\x00\x01(\x01+\x00)')
+    '_n[0]*_n[1]*(_n[2]+_n[3])'
+    '''
+    out = []
+    groups = []         # (bracket, where it starts in out, [(\over or \choose, where)])
+    last = None         # the kind of the last token: number, name, open, close, or op
+    holes = 0
+    closed = 0          # where the last group to close starts in out
+
+    for m in _tex_token.finditer(template):
+        kind, text = m.lastgroup, m.group()
+        if kind == 'command':
+            text = m.group('command')
+            if text in ('times', 'cdot'):
+                kind, text = 'other', '*'
+            elif text in ('left', 'right'):
+                continue
+            elif text in ('over', 'choose') and groups and groups[-1][0] == '{':
+                groups[-1][2].append((text, len(out)))
+                last = 'op'
+                continue
+            else:
+                kind = 'name'
+
+        if kind == 'backslash':
+            continue
+        if kind == 'space':
+            out.append(' ')
+            last = 'space'
+        elif kind in ('hole', 'value'):
+            if kind == 'value' and last in ('number', 'close'):
+                out.append('*')
+            out.append('_n[%d]' % holes)
+            holes += 1
+            last = 'number'
+        elif kind == 'name':
+            if last == 'number' and text in UNITS:
+                factor = UNITS[text]
+                out[-1] = '(%s*%r)' % (out[-1], factor) if factor != 1 else '(%s)' % out[-1]
+                closed, last = len(out)-1, 'close'
+                continue
+            if last in ('number', 'close'):
+                out.append('*')
+            out.append(text)
+            last = 'name'
+        elif text in '({':
+            if last in ('number', 'close'):
+                out.append('*')
+            groups.append((text, len(out), []))
+            out.append('(')
+            last = 'open'
+        elif text in ')}':
+            if not groups:
+                out.append(')')
+                last = 'close'
+                continue
+            bracket, start, splits = groups.pop()
+            if splits:
+                how, where = splits[0]
+                top = ''.join(out[start+1:where])
+                bottom = ''.join(out[where:])
+                fmt = '((%s)/(%s))' if how == 'over' else '(choose(%s,%s))'
+                out[start:] = [fmt % (top, bottom)]
+            else:
+                out.append(')')
+            closed, last = start, 'close'
+        elif text == '^':
+            out.append('**')
+            last = 'op'
+        elif text == '!' and last == 'number':
+            out[-1] = 'factorial(%s)' % out[-1]
+        elif text == '!' and last == 'close':
+            out[closed:] = ['factorial(%s)' % ''.join(out[closed:])]
+        else:
+            out.append(text)
+            last = 'op'
+    return ''.join(out)
+
+SAFE_NAMES = dict((name, globals()[name]) for name in '''sqrt log exp sin cos tan
+    asin acos atan hypot ceil floor fabs degrees radians pi e phi
+    sind cosd tand choose factorial'''.split())
+SAFE_NAMES.update(abs=abs, min=min, max=max, round=round)
+
+def unit_table(units):
+    '''Return TEX_UNITS with the units from a maynard Config added, as
+    name -> factor, with lengths in big points and anything else in the
+    base unit of its dimension (as ints where they are whole).  Units with an offset (like degrees C),
+    names that are not plain words, and names we use for functions
+    are left out.
+
+    >>> from maynard_config import parse_config
+    >>> cfg = parse_config(['u: LENGTH M 1', 'u: LENGTH BP 0.0254/72', 'u: MASS KG 1000',
+    ...                     'u: TIME MIN 60', 'u: TEMPERATURE DC 1 273.15', 'u: CURRENCY $ 1'])
+    >>> table = unit_table(cfg.units)
+    >>> round(table['m'], 6), table['kg'], table['pt'] == 72/72.27
+    (2834.645669, 1000, True)
+    >>> sorted(set(table) - set(TEX_UNITS))
+    ['kg', 'm']
+    '''
+    table = dict(TEX_UNITS)
+    bp = units['bp'][2] if units.get('bp', ('',))[0] == 'LENGTH' else Decimal('0.0254')/72
+    for key, (dimension, name, factor, offset) in units.items():
+        if offset is not None or not key.isalpha() or key in SAFE_NAMES:
+            continue
+        if dimension == 'LENGTH':
+            factor = factor/bp
+        table[key] = int(factor) if factor == factor.to_integral_value() else float(factor)
+    return table
+
+_BINARY = { ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+            ast.Div: operator.truediv, ast.FloorDiv: operator.floordiv,
+            ast.Mod: operator.mod, ast.Pow: power }
+_UNARY = { ast.USub: operator.neg, ast.UAdd: operator.pos }
+
+class _Leaf(object):
+    '''A number, or one of the _n, that a closure can use without a call.'''
+    def __init__(self, value=None, index=None):
+        self.value, self.index = value, index
+
+def _binary(f, left, right):
+    '''Return a closure for f(left, right), folding constants and reading
+    numbers and the _n directly rather than through another closure.'''
+    if isinstance(left, _Leaf) and isinstance(right, _Leaf):
+        i, j, u, v = left.index, right.index, left.value, right.value
+        if i is None and j is None:
+            try:
+                return _Leaf(f(u, v))
+            except Exception:
+                pass            # leave the error for when it is run
+        if i is not None and j is not None:
+            return lambda n: f(n[i], n[j])
+        if i is not None:
+            return lambda n: f(n[i], v)
+        if j is not None:
+            return lambda n: f(u, n[j])
+    left, right = _function(left), _function(right)
+    return lambda n: f(left(n), right(n))
+
+def _function(node):
+    '''Turn a leaf into a closure (others already are).'''
+    if not isinstance(node, _Leaf):
+        return node
+    if node.index is None:
+        value = node.value
+        return lambda n: value
+    i = node.index
+    return lambda n: n[i]
+
+def _closure(node):
+    '''Return a closure (a function of the numbers _n), or a _Leaf, that
+    works out an AST node, or raise SyntaxError for anything not allowed.'''
+    kind = type(node).__name__
+    if kind in ('Num', 'Constant'):
+        value = node.n if kind == 'Num' else node.value
+        if isinstance(value, numbers.Real) and not isinstance(value, bool):
+            return _Leaf(value)
+    elif kind == 'Name' and node.id in SAFE_NAMES:
+        return _Leaf(SAFE_NAMES[node.id])
+    elif kind == 'Subscript' and getattr(node.value, 'id', None) == '_n':
+        index = node.slice.value if type(node.slice).__name__ == 'Index' else node.slice
+        i = _closure(index)
+        if isinstance(i, _Leaf) and isinstance(i.value, int):
+            return _Leaf(index=i.value)
+    elif kind == 'BinOp' and type(node.op) in _BINARY:
+        return _binary(_BINARY[type(node.op)], _closure(node.left), _closure(node.right))
+    elif kind == 'UnaryOp' and type(node.op) in _UNARY:
+        f, operand = _UNARY[type(node.op)], _closure(node.operand)
+        if isinstance(operand, _Leaf) and operand.index is None:
+            try:
+                return _Leaf(f(operand.value))
+            except Exception:
+                pass
+        operand = _function(operand)
+        return lambda n: f(operand(n))
+    elif (kind == 'Call' and getattr(node.func, 'id', None) in SAFE_NAMES
+          and not node.keywords and not getattr(node, 'starargs', None)
+          and not getattr(node, 'kwargs', None)):
+        f = SAFE_NAMES[node.func.id]
+        args = [_closure(a) for a in node.args]
+        if len(args) == 1:
+            a = args[0]
+            if isinstance(a, _Leaf) and a.index is not None:
+                i = a.index
+                return lambda n: f(n[i])
+            a = _function(a)
+            return lambda n: f(a(n))
+        if len(args) == 2:
+            return _binary(f, *args)
+        args = [_function(a) for a in args]
+        return lambda n: f(*[a(n) for a in args])
+    raise SyntaxError('%s is not allowed' % kind)
+
+def compile_safely(python):
+    '''Compile an expression into a function of the numbers _n, allowing
+    only arithmetic, numbers, and the functions and constants in SAFE_NAMES.
+
+    >>> compile_safely('sqrt(_n[0])+_n[1]**2')((16, 3))
+    13.0
+    >>> compile_safely('__import__("os")')
+    Traceback (most recent call last):
+    ...
+    SyntaxError: Call is not allowed
+    >>> compile_safely('(1).__class__')
+    Traceback (most recent call last):
+    ...
+    SyntaxError: Attribute is not allowed
+    '''
+    return _function(_closure(ast.parse(python, '<proust>', 'eval').body))
 
-def workout(s):
-    '''De-Texify the expression then call eval().
-    Also spot units.
+@memoize(512)
+def _compiled(template):
+    '''Return (function or None, python) for a template, compiling it once.'''
+    python = translate_template(template)
+    try:
+        return compile_safely(python), python
+    except SyntaxError:
+        return None, python
+
+_units_config = None
+
+def load_units(config_file=DEFAULT_CONFIG):
+    '''Use the units in config_file (as well as TEX_UNITS), or just
+    TEX_UNITS if it cannot be read.  The table is only made again when
+    the config has changed, so this is cheap to call every time.'''
+    global UNITS, _units_config
+    try:
+        cfg = load_config(config_file)
+    except (IOError, OSError):
+        cfg = None
+    if cfg is _units_config and cfg is not None:
+        return
+    _units_config = cfg
+    table = unit_table(cfg.units) if cfg is not None else dict(TEX_UNITS)
+    if table != UNITS:
+        UNITS = table
+        _compiled.cache.clear()
+
+@memoize(64)
+def _holes(names):
+    '''Return a pattern for the numbers and the given names in an expression.'''
+    if not names:
+        return _number
+    words = '|'.join(sorted(names, key=len, reverse=True))
+    return re.compile(r'%s|(?<![A-Za-z\\])(?:%s)(?![A-Za-z])' % (_number.pattern, words))
+
+def workout(s, env=None):
+    '''De-Texify the expression then evaluate it.
+    Also spot units, and the named values in env.
+
+    The numbers are taken out first, so that the translation and the
+    compiled code are shared by every expression of the same shape, and
+    kept for the most recent shapes.  Nothing but arithmetic and the
+    functions in SAFE_NAMES can be run: anything else is shown in
+    brackets like a syntax error.
 
     >>> workout('1+1')
     2
@@ -66,35 +393,37 @@ def workout(s):
     >>> workout('3e^-3')
     0.14936120510359185
     >>> workout('210mm-3in')
-    379.2755905509
+    379.27559055118115
     >>> workout('20.2mm')  
-    57.259842519657994
+    57.259842519685044
+    >>> workout('4! + (1+2)!'), workout('2 3'), workout('open(1)')
+    (30, '[2 3]', '[open(1)]')
+    >>> workout('3.5!'), workout('(1-3)!')
+    ('[?factorial(3.5)]', '[?factorial((1-3))]')
+    >>> workout('1/0'), workout('10.0^400')
+    ('[?1/0]', '[?10.0**400]')
+    >>> workout('2rate(1+rate)', {'rate': 0.5})
+    1.5
 
     '''
-
-    s = s.replace(r'\times','*')
-    s = s.replace(r'\left(','(')
-    s = s.replace(r'\right)',')')
-    s = re.sub(r'{(.*?)\\over(.*?)}', r'((\1)/(\2))', s)
-    s = re.sub(r'{(.*?)\\choose(.*?)}', r'choose(\1,\2)', s)
-    s = s.replace(r'^','**')
-    s = s.replace(r'{', '(')
-    s = s.replace(r'}', ')')
-    s = s.replace('\\','')
-    s = re.sub('(\d)!',r'factorial(\1)',s)
-    s = re.sub('([0-9\)])([a-z\(])',r'\1*\2',s)
-    s = re.sub('(\d+(?:\.\d+)?)\*mm',r'(\1*2.83464566929)',s)
-    s = re.sub('(\d+(?:\.\d+)?)\*in',r'(\1*72)',s)
-    s = re.sub('(\d+(?:\.\d+)?)\*bp',r'(\1)',s)
-    s = re.sub('(\d+(?:\.\d+)?)\*pt',r'(\1*0.996264009963)',s)
+    if env:
+        holes = _holes(tuple(sorted(env)))
+        numbers = holes.findall(s)
+        code, python = _compiled(holes.sub(lambda m: '\x00' if m.group()[0] in '.0123456789' else '\x01', s))
+    else:
+        numbers = _number.findall(s)
+        code, python = _compiled(_number.sub('\x00', s))
+    if code is None:
+        return '['+_hole.sub(lambda m: numbers[int(m.group(1))], python)+']'
+    values = tuple(env[x] if env and x in env else float(x) if '.' in x else int(x) for x in numbers)
     try:
-        answer = eval(s)
-    except SyntaxError:
-        answer = '['+s+']'
-    except TypeError:
-        answer = '[?'+s+']'
+        answer = code(values)
+    except (TypeError, ValueError, ArithmeticError):
+        answer = '[?'+_hole.sub(lambda m: numbers[int(m.group(1))], python)+']'
     return answer
 
+ALPHABET = 'abcdefghijklmnopqrstuvwxyz1234567890!,.-+*/^\\{}()><'
+
 def find_expression(line,col):
     '''Given a line and a cursor pos, return a tuple of str (prefix, expression, suffix).
 
@@ -131,7 +460,7 @@ def find_expression(line,col):
     if col==0:
         return ('', '', line)
 
-    alphabet = 'abcdefghijklmnopqrstuvwxyz1234567890!,.-+*/^\\{}()><'
+    alphabet = ALPHABET
     target = ''
     p = col
     while p>=0:
@@ -150,7 +479,7 @@ def find_expression(line,col):
 
     return (line[0:p+1], target, line[col+1:])
 
-def evaluate_expression(target):
+def evaluate_expression(target, env=None):
     '''Check for terminal "signals" and call workout accordingly.
     
     If the expression ends in "=" then answer is "expr = answer".
@@ -163,14 +492,21 @@ def evaluate_expression(target):
     '0.5 = {1\\\\over2}'
     >>> evaluate_expression('')
     ''
+    >>> evaluate_expression('1/0=')
+    '[?1/0]?'
 
     '''
     if not target:
         return ''
 
-    if target.endswith('='):
-        target = target.strip('=')
-        answer = workout(target)
+    signal = target[-1] if target[-1] in '=\\' else ''
+    if signal:
+        target = target.strip(signal)
+    return _shown(target, signal, workout(target, env))
+
+def _shown(target, signal, answer):
+    '''Return the answer to target shown as the signal asks.'''
+    if signal == '=':
         try:
             approx = float('%g' % answer)
             rel = '=' if fabs(answer-approx)<1e-15 else '\\simeq'
@@ -178,25 +514,353 @@ def evaluate_expression(target):
         except:
             return answer+'?'
     
-    if target.endswith("\\"):
+    if signal == "\\":
         import fractions as f
-        target = target.strip("\\")
-        q = f.Fraction(workout(target)).limit_denominator()
+        q = f.Fraction(answer).limit_denominator()
         return '{0} = {{{1.numerator}\\over{1.denominator}}}'.format(target,q)
     
-    return '{0}'.format(workout(target))
+    return '{0}'.format(answer)
+
+_expression = '[%s]+' % re.escape(ALPHABET)
+# an answer is a number, as _shown gives it, or a fraction like {1\over2}
+_answer = r'-?(?:\d+(?:\.\d*)?|\.\d+)(?:e[-+]?\d+)?|\{-?\d+\\over\d+\}'
+_answered = re.compile(r'(?P<expr>%s) (?:=|\\simeq) (?P<answer>%s)(?P<suffix>\s*)\Z' % (_expression, _answer))
+_trailing = re.compile(r'(?P<expr>%s=?|=)(?P<suffix>\s*)\Z' % _expression)
+_calculation = re.compile(r'\d.*[-+*/^!(\\]|[-+*/^(\\].*\d')
+# ranges, phone numbers, dates, and numbers with leading zeros are not sums
+_not_calculation = re.compile(r'\A\d+(?:-\d+|([-/])\d+\1\d+)\Z|(?<![\d.])0\d')
+# nor, on a line of their own, are numbers in brackets and plain fractions
+_literal = re.compile(r'\A(?:\(*[-+]?(?:\d+(?:\.\d*)?|\.\d+)\)*|\d+/\d+)\Z')
+
+def _is_calculation(expression, env=None):
+    '''Is the expression a sum rather than a number, date, range, or
+    the like?  Anything that uses a name in env is.'''
+    if env and not set(_word.findall(expression)).isdisjoint(env):
+        return True
+    return bool(_calculation.search(expression)) and not _not_calculation.search(expression)
+
+def evaluate_line(line, env=None):
+    r'''Return the line with its trailing expression worked out.
+
+    This is what proust does at the cursor, for a line ending in "=" or
+    "\", but an answer already there (like "3+4 = 7") is worked out
+    again if it is a number and what comes before it is a sum, and a
+    line that is nothing but a calculation is replaced by its value,
+    unless it looks like a date, a phone number, a range, a number in
+    brackets or a plain fraction.  Anything that does not give a number
+    is left alone.  The names in env stand for their values.
+
+    >>> evaluate_line('Total: 3+4=')
+    'Total: 3+4 = 7'
+    >>> evaluate_line('Total: 3+5 = 7  ')
+    'Total: 3+5 = 8  '
+    >>> evaluate_line('half is 2/4 = {1\\over3}')
+    'half is 2/4 = {1\\over2}'
+    >>> evaluate_line('   2^10')
+    '   1024'
+    >>> evaluate_line('let x = 3'), evaluate_line('pages 12-15'), evaluate_line('1/0=')
+    ('let x = 3', 'pages 12-15', '1/0=')
+    >>> [evaluate_line(x) for x in ['2016-05-04', '555-1234', '10/12/2016', '12-15', '007*2']]
+    ['2016-05-04', '555-1234', '10/12/2016', '12-15', '007*2']
+    >>> evaluate_line('12-15='), evaluate_line('3/4=')
+    ('12-15 = -3', '3/4 = 0.75')
+    >>> evaluate_line('Step 1 = 2'), evaluate_line('Released 2016-05-04 = today')
+    ('Step 1 = 2', 'Released 2016-05-04 = today')
+    >>> evaluate_line('1+1 = 2 = 3'), evaluate_line('Due: 10/12/2016 = 3')
+    ('1+1 = 2 = 3', 'Due: 10/12/2016 = 3')
+    >>> [evaluate_line(x) for x in ['(1)', '24/7', '-5', '2016-05-04', '9-17']]
+    ['(1)', '24/7', '-5', '2016-05-04', '9-17']
+    >>> evaluate_line('cost: 2n+1=', {'n': 20})
+    'cost: 2n+1 = 41'
+    '''
+    m = _answered.search(line)
+    if m is not None:
+        expression, answer = m.group('expr'), m.group('answer')
+        signal = '\\' if answer.startswith('{') else '='
+        before = line[:m.start()].rstrip()
+        if ((not before or line[m.start()-1] == ' ') and not before.endswith('=')
+                and _is_calculation(expression, env)):
+            new = _worked(expression, signal, env)
+            if new is not None:
+                return line[:m.start()] + new + m.group('suffix')
+        return line
+
+    m = _trailing.search(line)
+    if m is None:
+        return line
+    expression = m.group('expr')
+    if expression.endswith('=') or expression.endswith('\\'):
+        new = _worked(expression[:-1], expression[-1], env)
+    elif (not line[:m.start()].strip() and not _literal.match(expression)
+          and _is_calculation(expression, env)):
+        new = _worked(expression, '', env)
+    else:
+        new = None
+    if new is None:
+        return line
+    return line[:m.start()] + new + m.group('suffix')
+
+def _worked(expression, signal, env=None):
+    '''Return evaluate_expression(expression+signal), or None if the
+    expression does not work out to a number.'''
+    try:
+        answer = workout(expression, env)
+        if not isinstance(answer, numbers.Number):
+            return None
+        return _shown(expression, signal, answer)
+    except Exception:
+        return None
+
+def evaluate_lines(lines):
+    '''Return a list of the lines with every expression in them worked out.
+
+    >>> evaluate_lines(['a 1+1=', 'no sums here', '6*7'])
+    ['a 1+1 = 2', 'no sums here', '42']
+    '''
+    return [evaluate_line(line) for line in lines]
+
+FILTER_CHUNK_SIZE = 1000      # lines sent to a worker at a time
+
+def filter_line(line):
+    r'''Return a line with the expression at its end worked out, as proust
+    does at the cursor, for the --filter mode.
+
+    "==" gives the answer in full rather than to six figures, and an
+    expression that starts with "$" (and may end with one before the
+    signal) is put back between dollars.  A "$" is never part of the
+    expression, and is never lost.  Lines that do not work out are
+    passed through as they are.
+
+    >>> filter_line('Total: 3+4=')
+    'Total: 3+4 = 7'
+    >>> filter_line('so ${2\\over3}$= ')
+    'so ${2\\over3} \\simeq 0.666667$ '
+    >>> filter_line('so $0.75$\\'), filter_line('a 1+1$'), filter_line('a $1+1=')
+    ('so $0.75 = {3\\over4}$', 'a 2$', 'a $1+1 = 2$')
+    >>> filter_line('exactly 2/3==')
+    'exactly 2/3 = 0.6666666666666666'
+    >>> filter_line('x $1+1==$'), filter_line('x $1+1$=='), filter_line('x $2+3=$')
+    ('x $1+1 = 2$', 'x $1+1 = 2$', 'x $2+3 = 5$')
+    >>> filter_line('  6*7'), filter_line('half 0.5\\'), filter_line('plain text')
+    ('  42', 'half 0.5 = {1\\over2}', 'plain text')
+    '''
+    body = line.rstrip()
+    tail = line[len(body):]
+    dollar = ''
+    if body.endswith('$'):
+        body, dollar = body[:-1], '$'
+    exact = body.endswith('==')
+    if exact:
+        body = body.rstrip('=') + '='
+    if not dollar and (body.endswith('$=') or body.endswith('$\\')):
+        body, dollar = body[:-2] + body[-1], '$'
+    prefix, expression, suffix = find_expression(body, len(body)-1)
+    if not expression:
+        return line
+
+    signal = expression[-1] if expression[-1] in '=\\' else ''
+    if signal:
+        expression = expression[:-1]
+    if exact:
+        answer = workout(expression)
+        if not isinstance(answer, numbers.Number):
+            return line
+        new = '{0} = {1}'.format(expression, repr(answer) if isinstance(answer, float) else answer)
+    else:
+        new = _worked(expression, signal)
+        if new is None:
+            return line
+    if dollar or prefix.endswith('$'):
+        new += '$'
+    return prefix + new + suffix + tail
+
+def filter_lines(lines, jobs=1, config_file=DEFAULT_CONFIG):
+    '''Generate filter_line(line) for each of lines, in order, spreading
+    the work over a pool of processes if jobs is more than one.  Each
+    process loads the units from config_file itself, so that they are
+    there however the processes are started.
+
+    >>> list(filter_lines(['1+1=', 'x', '2^3']))
+    ['1+1 = 2', 'x', '8']
+    '''
+    if jobs > 1:
+        from multiprocessing import Pool
+        pool = Pool(jobs, initializer=load_units, initargs=(config_file,))
+        try:
+            for line in pool.imap(filter_line, lines, FILTER_CHUNK_SIZE):
+                yield line
+        finally:
+            pool.terminate()
+    else:
+        for line in lines:
+            yield filter_line(line)
+
+_binding = re.compile(r'(?P<head>\s*(?P<name>[a-z]+)\s*:=\s*)(?P<expr>.*?)(?:\s+(?:=|\\simeq)\s+\S+)?(?P<suffix>\s*)\Z')
+_word = re.compile(r'(?<![A-Za-z\\])[a-z]+(?![A-Za-z])')
+
+class Sheet(object):
+    r'''The named values in a document, and the lines that use them,
+    remembered from one run to the next so that only what has changed
+    is worked out again.
+
+    A line like "rate := 0.05" names a value, which any other line (above
+    or below it) can use.  On each run a definition is worked out again
+    only if its line has changed or it uses a name that has, and any
+    other line only if it is new or edited, or uses a name whose value
+    has changed.  worked is how many lines that came to.  A name bound
+    here hides a unit or constant of the same name, and a line that uses
+    a name whose definition does not work out is left alone.
+
+    >>> sheet = Sheet()
+    >>> lines = sheet.update(['n := 20', 'rate := n/100', 'cost: 2n+1=', 'tax: 50rate=', 'notes'])
+    >>> lines, sheet.worked
+    (['n := 20 = 20', 'rate := n/100 = 0.2', 'cost: 2n+1 = 41', 'tax: 50rate = 10', 'notes'], 5)
+    >>> lines[0] = 'n := 30'
+    >>> sheet.update(lines), sheet.worked
+    (['n := 30 = 30', 'rate := n/100 = 0.3', 'cost: 2n+1 = 61', 'tax: 50rate = 15', 'notes'], 4)
+    >>> sheet.update(['x := y+1', 'y := x+1', 'z := 2'])
+    ['x := y+1', 'y := x+1', 'z := 2 = 2']
+    >>> sheet.update(['a := 1/0', 'r := sqrt(-1)', 'big := 10^400.5', 'k := 3', 'total: 2k+a=', 'more: 2k='])
+    ['a := 1/0', 'r := sqrt(-1)', 'big := 10^400.5', 'k := 3 = 3', 'total: 2k+a=', 'more: 2k = 6']
+    '''
+    def __init__(self):
+        self.values = {}        # name -> value
+        self.rendered = {}      # name -> its line as we left it
+        self.done = {}          # other lines as we left them -> the words in them
+        self.bound = set()      # every name with a definition, worked out or not
+        self.worked = 0
+
+    def env(self):
+        '''Return the names bound, with their values, or None for those
+        that did not work out.'''
+        return dict((name, self.values.get(name)) for name in self.bound)
+
+    def update(self, lines):
+        '''Return the lines with what needs working out worked out.'''
+        found = {}
+        for i, line in enumerate(lines):
+            if ':=' in line:
+                m = _binding.match(line)
+                if m is not None and m.group('name') not in found:
+                    found[m.group('name')] = (i, m)
+        bound = set(found)
+
+        deps, users = {}, {}
+        for name, (i, m) in found.items():
+            deps[name] = set(_word.findall(m.group('expr'))) & bound
+            for d in deps[name]:
+                users.setdefault(d, set()).add(name)
+
+        removed = self.bound - bound
+        dirty = set(name for name, (i, m) in found.items() if self.rendered.get(name) != lines[i])
+        todo = list(dirty | removed)
+        while todo:
+            for name in users.get(todo.pop(), ()):
+                if name not in dirty:
+                    dirty.add(name)
+                    todo.append(name)
+
+        values = dict((name, v) for name, v in self.values.items() if name in found and name not in dirty)
+        busy = set()
+        def work(name):
+            if name in values or name in busy:
+                return
+            busy.add(name)
+            for d in deps[name] & dirty:
+                work(d)
+            expr = found[name][1].group('expr')
+            try:
+                value = workout(expr, self._env(deps[name], values, bound))
+            except Exception:
+                return
+            if isinstance(value, numbers.Number):
+                values[name] = value
+        for name in dirty:
+            work(name)
+        changed = set(name for name in dirty | removed if values.get(name) != self.values.get(name))
+        changed |= bound ^ self.bound
+
+        new_lines, rendered, done = [], {}, {}
+        self.worked = 0
+        for i, line in enumerate(lines):
+            m = _binding.match(line) if ':=' in line else None
+            if m is not None and found.get(m.group('name'), (None,))[0] == i:
+                name = m.group('name')
+                if name in dirty:
+                    self.worked += 1
+                    new = _worked(m.group('expr'), '=', self._env(deps[name], values, bound))
+                    if name in values and new is not None:
+                        line = m.group('head') + new + m.group('suffix')
+                rendered[name] = line
+            else:
+                words = self.done.get(line)
+                if words is None or not changed.isdisjoint(words):
+                    self.worked += 1
+                    line = evaluate_line(line, self._env(set(_word.findall(line)), values, bound))
+                    words = frozenset(_word.findall(line))
+                done[line] = words
+            new_lines.append(line)
+        self.values, self.rendered, self.done, self.bound = values, rendered, done, bound
+        return new_lines
+
+    @staticmethod
+    def _env(names, values, bound):
+        '''The values of the names that are bound, with None for those
+        that did not work out, so that using them fails.'''
+        return dict((name, values.get(name)) for name in names if name in bound)
+
+_sheets = {}
+
+def sheet_for(key):
+    '''Return the Sheet kept for a buffer (or anything else) between runs.'''
+    if key not in _sheets:
+        _sheets[key] = Sheet()
+    return _sheets[key]
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='Work out the expressions at the ends of lines.')
+    parser.add_argument('--filter', action='store_true',
+                        help='read lines from stdin and write them to stdout worked out')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='how many processes to share the work between (default 1)')
+    parser.add_argument('-c', '--config', default=DEFAULT_CONFIG,
+                        help='the maynard config file to take units from (default %(default)s)')
+    args = parser.parse_args(argv)
+    if not args.filter:
+        parser.error('outside Vim, proust only runs as a --filter')
+
+    load_units(args.config)
+
+    out = sys.stdout
+    for line in filter_lines((line.rstrip('\n') for line in sys.stdin), args.jobs, args.config):
+        out.write(line + '\n')
+    return 0
 
 if __name__ == '__main__':
     try:
         import vim
-        line = vim.current.line
-        (row,col) = vim.current.window.cursor
-
-        (prefix, expression, suffix) = find_expression(line,col)
-        answer = evaluate_expression(expression)
-        vim.current.line = prefix+answer+suffix
-        vim.current.window.cursor = (row,1+len(prefix+answer)) 
     except ImportError:
-        pass
-
+        vim = None
+    if vim is None:
+        import proust
+        sys.exit(proust.main())
+    else:
+        # use the imported module, so that its caches last from one call to the next
+        import proust
+        proust.load_units()
+        r = vim.current.range
+        if r.end > r.start:
+            # a range: work out everything in it, and write back once
+            lines = r[:]
+            new_lines = proust.sheet_for(vim.current.buffer.number).update(lines)
+            if new_lines != lines:
+                r[:] = new_lines
+        else:
+            line = vim.current.line
+            (row,col) = vim.current.window.cursor
 
+            (prefix, expression, suffix) = proust.find_expression(line,col)
+            answer = proust.evaluate_expression(expression, proust.sheet_for(vim.current.buffer.number).env())
+            vim.current.line = prefix+answer+suffix
+            vim.current.window.cursor = (row,1+len(prefix+answer)) 
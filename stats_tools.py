@@ -0,0 +1,207 @@
+#! /usr/bin/env python
+# encoding: utf-8
+
+# Summary statistics for lists of numbers (Decimals or otherwise)
+#
+# Mean and variance are worked out in one pass.  For Decimals we add up
+# the values and their squares exactly, as integers scaled by a power of
+# ten, so the answers are rounded only once; other numbers use Welford's
+# update, which does not lose precision the way sum(x*x) - n*mean*mean
+# can in floating point.  The median and percentiles come from
+# quickselect, in O(n) expected time rather than the O(n log n) of
+# sorting; the selection functions rearrange the list they are given
+# instead of copying it.
+
+from __future__ import division
+import random
+from decimal import Decimal
+
+def welford(data):
+    """Return (count, mean, sum of squared deviations) in one pass.
+
+    >>> welford([2, 4, 4, 4, 5, 5, 7, 9])
+    (8, 5.0, 32.0)
+    """
+    n, mean, m2 = 0, 0, 0
+    for x in data:
+        n += 1
+        delta = x - mean
+        mean = mean + delta / n
+        m2 = m2 + delta * (x - mean)
+    return n, mean, m2
+
+def decimal_sums(data):
+    """Return (count, sum, sum of squares, exponent) for a list of finite
+    Decimals, with the sums as exact integers in units of 10**exponent,
+    or None if the list holds anything else.
+
+    >>> decimal_sums(map(Decimal, '1.5 -2 0.25'.split()))
+    (3, -25, 63125, -2)
+    """
+    n = s1 = s2 = 0
+    exponent = None
+    for x in data:
+        if not isinstance(x, Decimal) or not x.is_finite():
+            return None
+        sign, digits, e = x.as_tuple()
+        m = int(''.join(map(str, digits)))
+        if sign:
+            m = -m
+        if exponent is None:
+            exponent = e
+        elif e < exponent:
+            scale = 10 ** (exponent - e)
+            s1 *= scale
+            s2 *= scale * scale
+            exponent = e
+        if e > exponent:
+            m *= 10 ** (e - exponent)
+        n += 1
+        s1 += m
+        s2 += m * m
+    return n, s1, s2, exponent
+
+def mean(data):
+    """Return the arithmetic mean of a list of numbers.
+
+    >>> print mean(map(Decimal, '1 2 3 4.0'.split()))
+    2.5
+    >>> mean([1, 2, 3, 4])
+    2.5
+    """
+    sums = decimal_sums(data)
+    if sums is None:
+        n, m, m2 = welford(data)
+    else:
+        n, s1, s2, exponent = sums
+        if n:
+            m = (Decimal(s1) / n).scaleb(exponent)
+    if n < 1:
+        raise ValueError, "no data"
+    return m
+
+def variance(data, sample=True):
+    """Return the sample variance, or the population variance if sample is false.
+
+    >>> data = map(Decimal, '2 4 4 4 5 5 7 9'.split())
+    >>> print variance(data, False), variance(data)
+    4 4.571428571428571428571428571
+    >>> variance([2, 4, 4, 4, 5, 5, 7, 9], False)
+    4.0
+    """
+    ddof = 1 if sample else 0
+    sums = decimal_sums(data)
+    if sums is None:
+        n, m, m2 = welford(data)
+    else:
+        n, s1, s2, exponent = sums
+    if n < 1 + ddof:
+        raise ValueError, "not enough data"
+    if sums is None:
+        return m2 / (n - ddof)
+    return (Decimal(n * s2 - s1 * s1) / (n * (n - ddof))).scaleb(2 * exponent)
+
+def stddev(data, sample=True):
+    """Return the sample (or population) standard deviation.
+
+    >>> print stddev(map(Decimal, '2 4 4 4 5 5 7 9'.split()), False)
+    2
+    """
+    v = variance(data, sample)
+    return v.sqrt() if hasattr(v, 'sqrt') else v ** 0.5
+
+def select(data, k):
+    """Return the k-th smallest item (from 0), rearranging data in place.
+
+    Afterwards data[k] is that item, everything before it is no bigger
+    and everything after it is no smaller.
+
+    >>> data = [5, 1, 4, 2, 3, 9, 0]
+    >>> select(data, 3), sorted(data[:3]), sorted(data[4:])
+    (3, [0, 1, 2], [4, 5, 9])
+    """
+    if not 0 <= k < len(data):
+        raise IndexError, "k out of range"
+    lo, hi = 0, len(data) - 1
+    while lo < hi:
+        pivot = data[random.randint(lo, hi)]
+        i, j = lo, hi
+        while i <= j:
+            while data[i] < pivot: i += 1
+            while data[j] > pivot: j -= 1
+            if i <= j:
+                data[i], data[j] = data[j], data[i]
+                i += 1
+                j -= 1
+        if k <= j:
+            hi = j
+        elif k >= i:
+            lo = i
+        else:
+            break
+    return data[k]
+
+def percentile(data, p):
+    """Return the p-th percentile of data, interpolating between the
+    nearest ranks, as a spreadsheet does.  Rearranges data.
+
+    >>> data = map(Decimal, '15 20 35 40 50'.split())
+    >>> print percentile(data, Decimal(40)), percentile(data, 100), percentile(data, 0)
+    29 50 15
+    >>> percentile([1, 2, 3, 4], 50)
+    2.5
+    """
+    if not data:
+        raise ValueError, "no data"
+    if not 0 <= p <= 100:
+        raise ValueError, "p must be between 0 and 100"
+    position = (len(data) - 1) * p          # in hundredths of a rank
+    k = int(position // 100)
+    low = select(data, k)
+    if position == 100 * k:
+        return low
+    high = min(data[k+1:])
+    return low + (high - low) * (position - 100 * k) / 100
+
+def median(data):
+    """Return the median of data, rearranging it.
+
+    >>> median([3, 1, 2]), median([4, 1, 3, 2])
+    (2, 2.5)
+    """
+    if not data:
+        raise ValueError, "no data"
+    n = len(data)
+    middle = select(data, n // 2)
+    if n % 2:
+        return middle
+    return (max(data[:n//2]) + middle) / 2
+
+def histogram(data, bins=10):
+    """Count the items in bins of equal width from the least item to the greatest.
+
+    Returns the list of counts; the last bin includes the greatest item.
+
+    >>> histogram([1, 2, 2, 3, 3, 3, 4, 10], 3)
+    [6, 1, 1]
+    >>> histogram([5, 5], 2)
+    [2, 0]
+    """
+    bins = int(bins)
+    if bins < 1:
+        raise ValueError, "need at least one bin"
+    if not data:
+        return [0] * bins
+    low, high = min(data), max(data)
+    counts = [0] * bins
+    width = high - low
+    if not width:
+        counts[0] = len(data)
+        return counts
+    for x in data:
+        counts[min(int((x - low) * bins / width), bins - 1)] += 1
+    return counts
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()